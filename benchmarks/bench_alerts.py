@@ -0,0 +1,63 @@
+# بنچمارک موتورهای بررسی هشدار: ایندکس مرتب‌شده (bisect) در برابر ایندکس برداری (numpy)
+# اجرا: python benchmarks/bench_alerts.py --alerts 1000000 --ticks 10
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crypto_bot import CHECK_INTERVAL, CURRENCIES, AlertIndex, AlertRecord, VectorAlertIndex, np  # noqa: E402
+
+def make_alerts(count, base_prices):
+    coins = list(base_prices)
+    alerts = []
+    for alert_id in range(1, count + 1):
+        coin = random.choice(coins)
+        original = base_prices[coin]
+        alerts.append(AlertRecord(alert_id, str(alert_id % 100000), coin, original * random.uniform(0.8, 1.2), original))
+    return alerts
+
+def run(engine, alerts, ticks):
+    start = time.perf_counter()
+    index = engine()
+    index.rebuild(alerts)
+    index.triggered({})  # ساخت آرایه‌ها در موتور برداری
+    build = time.perf_counter() - start
+    timings = []
+    fired = 0
+    for prices in ticks:
+        start = time.perf_counter()
+        fired += len(index.triggered(prices))
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return build, timings[len(timings) // 2], timings[-1], fired
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--alerts', type=int, default=1000000)
+    parser.add_argument('--ticks', type=int, default=10)
+    parser.add_argument('--drift', type=float, default=0.05, help='حداکثر تغییر نسبی قیمت در هر دور')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    base_prices = {coin: random.uniform(0.01, 50000) for coin in CURRENCIES}
+    alerts = make_alerts(args.alerts, base_prices)
+    ticks = [
+        {coin: price * random.uniform(1 - args.drift, 1 + args.drift) for coin, price in base_prices.items()}
+        for _ in range(args.ticks)
+    ]
+
+    engines = [('bisect', AlertIndex)]
+    if np is not None:
+        engines.append(('numpy', VectorAlertIndex))
+    print(f"alerts={args.alerts} coins={len(base_prices)} ticks={args.ticks} drift={args.drift} budget={CHECK_INTERVAL}s")
+    print(f"{'engine':<8} {'build (s)':>10} {'p50 tick (ms)':>14} {'max tick (ms)':>14} {'fired':>10}")
+    for name, engine in engines:
+        build, p50, worst, fired = run(engine, alerts, ticks)
+        print(f"{name:<8} {build:>10.2f} {p50 * 1000:>14.1f} {worst * 1000:>14.1f} {fired:>10}")
+
+if __name__ == '__main__':
+    main()
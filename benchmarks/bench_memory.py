@@ -0,0 +1,81 @@
+# بنچمارک حافظه کش کاربران و هشدارها (بدون شبکه و دیتابیس)
+# نمایش قبلی (یک دیکشنری برای هر سطر، مانند RealDictCursor) با رکوردهای __slots__ مقایسه و کل کش Storage هم اندازه‌گیری می‌شود
+# اجرا: python benchmarks/bench_memory.py --users 300000 --alerts 1000000
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crypto_bot import CURRENCIES, AlertRecord, Storage, UserRecord  # noqa: E402
+
+# سطرهای مصنوعی به شکل خروجی کرسر tuple؛ مثل psycopg2 هر سطر رشته‌های تازه خودش را دارد
+def user_rows(users, seed):
+    rng = random.Random(seed)
+    for i in range(users):
+        yield str(100000000 + i), f'First{i}', f'Last{i}', rng.choice(('en', 'fa')), rng.random() < 0.1
+
+def alert_rows(users, alerts, seed):
+    rng = random.Random(seed)
+    coins = list(CURRENCIES)
+    for alert_id in range(1, alerts + 1):
+        price = rng.uniform(0.01, 50000)
+        yield alert_id, str(100000000 + rng.randrange(users)), ''.join(list(rng.choice(coins))), price * 1.1, price
+
+# نمایش قبلی: دیکشنری هر سطر در users و alerts
+def dicts(args):
+    user_columns = ('user_id', 'first_name', 'last_name', 'lang', 'daily_report')
+    alert_columns = ('id', 'user_id', 'coin', 'price', 'original_price')
+    users = {row[0]: dict(zip(user_columns, row)) for row in user_rows(args.users, args.seed)}
+    alerts = {}
+    for row in alert_rows(args.users, args.alerts, args.seed):
+        alert = dict(zip(alert_columns, row))
+        alerts.setdefault(alert['user_id'], []).append(alert)
+    return users, alerts
+
+# نمایش فعلی: همان ساختاری که Storage.snapshot و apply_snapshot می‌سازند (بدون ایندکس هشدارها)
+def records(args):
+    users = {sys.intern(row[0]): UserRecord(*row[1:]) for row in user_rows(args.users, args.seed)}
+    alerts = {}
+    for alert in (AlertRecord(*row) for row in alert_rows(args.users, args.alerts, args.seed)):
+        alerts.setdefault(alert.user_id, []).append(alert)
+    return users, alerts
+
+# کل کش Storage شامل ایندکس هشدارها و ارزهای تحت نظر، برای مقایسه با بودجه حافظه
+def storage(args):
+    store = Storage()
+    users = {sys.intern(row[0]): UserRecord(*row[1:]) for row in user_rows(args.users, args.seed)}
+    store.apply_snapshot(users, [AlertRecord(*row) for row in alert_rows(args.users, args.alerts, args.seed)])
+    return store
+
+def measure(build, args):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build(args)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak, elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--alerts', type=int, default=300000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"users={args.users} alerts={args.alerts}")
+    print(f"{'layout':<10} {'resident (MB)':>14} {'peak (MB)':>10} {'per user+alerts (B)':>20} {'build (s)':>10}")
+    for name, build in (('dicts', dicts), ('records', records), ('storage', storage)):
+        result, current, peak, elapsed = measure(build, args)
+        per_user = current / max(args.users, 1)
+        print(f"{name:<10} {current / 2**20:>14.1f} {peak / 2**20:>10.1f} {per_user:>20.0f} {elapsed:>10.2f}")
+        del result
+
+if __name__ == '__main__':
+    main()
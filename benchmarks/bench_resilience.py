@@ -0,0 +1,77 @@
+# بنچمارک رفتار دریافت قیمت هنگام قطعی CoinGecko با سرور آزمایشی (fake_coingecko)
+# در سه مرحله سالم، قطعی و بازگشت، درخواست‌های کاربران شبیه‌سازی و تعداد درخواست به سرویس و نوع پاسخ‌ها شمرده می‌شود
+# اجرا: python benchmarks/bench_resilience.py --phase 20 --users 50
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crypto_bot import CURRENCIES, CoinGeckoClient, PriceCache  # noqa: E402
+from fake_coingecko import serve  # noqa: E402
+
+async def lookup(cache, coins, results):
+    try:
+        data = await cache.get_many(coins)
+    except Exception:
+        results['failed'] += len(coins)
+        return
+    for coin in coins:
+        if coin not in data:
+            results['failed'] += 1
+        elif 'stale' in data[coin]:
+            results['stale'] += 1
+        else:
+            results['fresh'] += 1
+
+async def run_phase(cache, fake, seconds, users, coins):
+    results = Counter()
+    before = Counter(fake.stats)
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        # هر کاربر در هر ثانیه قیمت یک ارز تصادفی را می‌خواهد
+        await asyncio.gather(*(lookup(cache, [random.choice(coins)], results) for _ in range(users)))
+        await asyncio.sleep(1)
+    upstream = fake.stats - before
+    return results, upstream
+
+async def run(args):
+    server, url = serve(coins=len(CURRENCIES))
+    fake = server.fake
+    client = CoinGeckoClient(base_url=url)
+    client.breaker.reset_timeout = args.reset
+    client.breaker.max_timeout = args.reset * 4
+    cache = PriceCache(client.simple_price, ttl=args.ttl)
+    coins = list(CURRENCIES)[:args.coins]
+    phases = [('healthy', 0.0), ('outage', 1.0), ('recovery', 0.0)]
+    print(f"users={args.users}/s coins={len(coins)} ttl={args.ttl}s phase={args.phase}s breaker_reset={args.reset}s")
+    print(f"{'phase':<10} {'upstream':>9} {'5xx':>6} {'fresh':>7} {'stale':>7} {'failed':>7} {'breaker':>10}")
+    for name, error_rate in phases:
+        fake.configure(error_rate=error_rate)
+        results, upstream = await run_phase(cache, fake, args.phase, args.users, coins)
+        print(f"{name:<10} {sum(upstream.values()):>9} {upstream['500']:>6} {results['fresh']:>7} "
+              f"{results['stale']:>7} {results['failed']:>7} {client.breaker.state:>10}")
+    await client.close()
+    server.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--phase', type=float, default=20, help='مدت هر مرحله (ثانیه)')
+    parser.add_argument('--users', type=int, default=50, help='تعداد درخواست قیمت در هر ثانیه')
+    parser.add_argument('--coins', type=int, default=20)
+    parser.add_argument('--ttl', type=float, default=2)
+    parser.add_argument('--reset', type=float, default=2, help='مهلت اولیه قطع‌کننده (ثانیه)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    logging.getLogger('crypto_bot').setLevel(logging.ERROR)
+    asyncio.run(run(args))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# بنچمارک مسیر جریانی قیمت با منبع شبیه‌سازی‌شده (بدون شبکه و دیتابیس)
+# زمان پردازش هر تیک در جریان و تأخیر تشخیص هشدار در حالت درخواستی (هر poll-interval ثانیه) مقایسه می‌شود؛
+# حالت درخواستی مثل check_alerts از PriceRanges می‌گذرد و بازه فقط نمونه‌هایی را دارد که ربات واقعاً می‌بیند:
+# خود دریافت‌ها و (با --lookups) جستجوی قیمت کاربران در همان فرایند؛ نقش alerts هیچ جستجویی ندارد
+# اجرا: python benchmarks/bench_stream.py --alerts 100000 --ticks 3600 --poll-interval 60 --lookups 0.5
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crypto_bot import CURRENCIES, AlertIndex, AlertRecord, PriceRanges, SimulatedFeed, WatchedCoins  # noqa: E402
+
+def make_alerts(count, coins, spread):
+    alerts = []
+    for alert_id in range(1, count + 1):
+        alerts.append(AlertRecord(
+            alert_id, str(alert_id % 100000), random.choice(coins), 100.0 * random.uniform(1 - spread, 1 + spread), 100.0
+        ))
+    return alerts
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+async def stream(alerts, feed):
+    index = AlertIndex()
+    index.rebuild(alerts)
+    ticks = []
+    fired_at = {}
+    timings = []
+    start = time.perf_counter()
+    async for data in feed.ticks():
+        tick_start = time.perf_counter()
+        prices = {coin: entry['usd'] for coin, entry in data.items()}
+        for alert in index.triggered(prices):
+            index.remove(alert.id)
+            fired_at[alert.id] = len(ticks)
+        timings.append(time.perf_counter() - tick_start)
+        ticks.append(prices)
+    return ticks, fired_at, timings, time.perf_counter() - start
+
+# دریافت هر every تیک؛ lookups تعداد جستجوی قیمت کاربران در هر تیک (ارز تصادفی) است که مثل کش قیمت به PriceRanges می‌رسد
+def poll(alerts, ticks, every, lookups=0.0, seed=1):
+    rng = random.Random(seed)
+    index = AlertIndex()
+    index.rebuild(alerts)
+    watched = WatchedCoins()
+    coins = list(ticks[0])
+    for coin in coins:
+        watched.acquire(coin)
+    ranges = PriceRanges(watched)
+    fired_at = {}
+    for i, tick in enumerate(ticks):
+        for _ in range(int(lookups) + (rng.random() < lookups % 1)):
+            coin = rng.choice(coins)
+            ranges.observe(coin, tick[coin], tick[coin])
+        if (i + 1) % every:
+            continue
+        highs, lows = ranges.take({coin: {'usd': price} for coin, price in tick.items()})
+        for alert in index.triggered(highs, lows):
+            index.remove(alert.id)
+            fired_at[alert.id] = i
+    return fired_at
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--alerts', type=int, default=100000)
+    parser.add_argument('--coins', type=int, default=len(CURRENCIES))
+    parser.add_argument('--ticks', type=int, default=3600)
+    parser.add_argument('--tick-interval', type=float, default=1.0, help='فاصله شبیه‌سازی‌شده تیک‌ها (ثانیه)')
+    parser.add_argument('--poll-interval', type=float, default=60, help='فاصله دریافت در حالت درخواستی (ثانیه)')
+    parser.add_argument('--lookups', type=float, default=0.0, help='جستجوی قیمت کاربران در همان فرایند (در ثانیه)')
+    parser.add_argument('--volatility', type=float, default=0.002)
+    parser.add_argument('--spread', type=float, default=0.03, help='حداکثر فاصله نسبی هدف هشدارها از قیمت اولیه')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    coins = list(CURRENCIES)[:args.coins]
+    alerts = make_alerts(args.alerts, coins, args.spread)
+    feed = SimulatedFeed(
+        WatchedCoins(), coins=coins, interval=0, volatility=args.volatility, seed=args.seed, limit=args.ticks
+    )
+    ticks, streamed, timings, elapsed = asyncio.run(stream(alerts, feed))
+    every = max(int(args.poll_interval / args.tick_interval), 1)
+
+    print(f"alerts={args.alerts} coins={len(coins)} ticks={len(ticks)} tick={args.tick_interval}s poll={args.poll_interval}s")
+    print(f"stream: {len(ticks) / elapsed:.0f} ticks/s, p50 tick {percentile(timings, 0.5) * 1000:.3f} ms, "
+          f"p99 tick {percentile(timings, 0.99) * 1000:.3f} ms, fired {len(streamed)}")
+    modes = [('poll', 0.0)] + ([(f"poll+{args.lookups:g} lookups/s", args.lookups)] if args.lookups else [])
+    for name, lookups in modes:
+        polled = poll(alerts, ticks, every, lookups * args.tick_interval, args.seed)
+        delays = [(polled[alert_id] - tick) * args.tick_interval for alert_id, tick in streamed.items() if alert_id in polled]
+        missed = sum(1 for alert_id in streamed if alert_id not in polled)
+        print(f"{name + ':':<7} fired {len(polled)}, missed {missed} (reverted between polls), "
+              f"delay p50 {percentile(delays, 0.5):.1f} s, p99 {percentile(delays, 0.99):.1f} s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# سرور آزمایشی CoinGecko برای اجرا و آزمایش ربات بدون شبکه
+# مسیرهای /api/v3/ping، /api/v3/simple/price و /api/v3/coins/list را با قیمت‌های گام تصادفی پاسخ می‌دهد
+# و می‌تواند تأخیر، خطای 500 و محدودیت نرخ (429 با Retry-After) را شبیه‌سازی کند
+# اجرا: python benchmarks/fake_coingecko.py --port 8090 --error-rate 0.2 --rate-limit 10
+# سپس: COINGECKO_API=http://127.0.0.1:8090/api/v3 python crypto_bot.py
+# تغییر حالت در حین اجرا: curl 'http://127.0.0.1:8090/control?error_rate=1&latency=0.5'
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crypto_bot import COIN_SYMBOLS, CURRENCIES  # noqa: E402
+
+class FakeCoinGecko:
+    OPTIONS = {'latency': float, 'error_rate': float, 'rate_limit': int, 'retry_after': int, 'volatility': float}
+
+    def __init__(self, coins=1000, latency=0.0, error_rate=0.0, rate_limit=0, retry_after=5, volatility=0.001, seed=1):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit  # حداکثر درخواست در ثانیه (صفر = بدون محدودیت)
+        self.retry_after = retry_after
+        self.volatility = volatility
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = Counter()
+        self.window = (0, 0)  # (ثانیه جاری، تعداد درخواست در آن)
+        self.coins = [{'id': coin, 'symbol': COIN_SYMBOLS.get(coin, '').lower(), 'name': coin.replace('-', ' ').title()}
+                      for coin in CURRENCIES]
+        for i in range(max(coins - len(self.coins), 0)):
+            self.coins.append({'id': f'token-{i}', 'symbol': f't{i}', 'name': f'Token {i}'})
+        self.prices = {coin['id']: self.random.uniform(0.01, 50000) for coin in self.coins}
+        self.opens = dict(self.prices)
+
+    def configure(self, **options):
+        for name, value in options.items():
+            setattr(self, name, self.OPTIONS[name](value))
+
+    def limited(self):
+        second = int(time.time())
+        with self.lock:
+            current, count = self.window
+            count = count + 1 if current == second else 1
+            self.window = (second, count)
+        return self.rate_limit and count > self.rate_limit
+
+    def simple_price(self, ids):
+        data = {}
+        with self.lock:
+            for coin in ids:
+                if coin in self.prices:
+                    self.prices[coin] *= 1 + self.random.gauss(0, self.volatility)
+                    price = self.prices[coin]
+                    data[coin] = {'usd': round(price, 8), 'usd_24h_change': (price / self.opens[coin] - 1) * 100}
+        return data
+
+    def handle(self, path, query):
+        if path == '/control':
+            self.configure(**{name: values[0] for name, values in query.items() if name in self.OPTIONS})
+            return 200, {name: getattr(self, name) for name in self.OPTIONS}, {}
+        if path == '/stats':
+            return 200, dict(self.stats), {}
+        if self.latency:
+            time.sleep(self.latency)
+        if self.limited():
+            self.stats['429'] += 1
+            return 429, {'status': {'error_code': 429, 'error_message': 'rate limited'}}, {'Retry-After': str(self.retry_after)}
+        if self.random.random() < self.error_rate:
+            self.stats['500'] += 1
+            return 500, {'error': 'internal error'}, {}
+        self.stats['200'] += 1
+        if path == '/api/v3/ping':
+            return 200, {'gecko_says': '(V3) To the Moon!'}, {}
+        if path == '/api/v3/coins/list':
+            return 200, self.coins, {}
+        if path == '/api/v3/simple/price':
+            ids = [coin for coin in query.get('ids', [''])[0].split(',') if coin]
+            return 200, self.simple_price(ids), {}
+        return 404, {'error': 'not found'}, {}
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        status, payload, headers = self.server.fake.handle(url.path, parse_qs(url.query))
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# شروع سرور در یک رشته پس‌زمینه؛ پورت صفر یعنی پورت آزاد دلخواه
+def serve(host='127.0.0.1', port=0, **options):
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.fake = FakeCoinGecko(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/api/v3"
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--coins', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0, help='تأخیر هر پاسخ (ثانیه)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='نسبت پاسخ‌های 500')
+    parser.add_argument('--rate-limit', type=int, default=0, help='حداکثر درخواست در ثانیه پیش از پاسخ 429')
+    parser.add_argument('--retry-after', type=int, default=5)
+    args = parser.parse_args()
+
+    server, url = serve(args.host, args.port, coins=args.coins, latency=args.latency, error_rate=args.error_rate,
+                        rate_limit=args.rate_limit, retry_after=args.retry_after)
+    print(f"fake CoinGecko listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(f"responses: {dict(server.fake.stats)}")
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
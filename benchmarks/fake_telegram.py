@@ -0,0 +1,118 @@
+# سرور آزمایشی Bot API تلگرام برای اجرا و بنچمارک ربات بدون شبکه
+# متدهای getMe، sendMessage، editMessageText، answerCallbackQuery، setWebhook و getUpdates را پاسخ می‌دهد،
+# زمان دریافت هر پیام را ثبت می‌کند و می‌تواند تأخیر و خطای 429 (flood) را شبیه‌سازی کند
+# اجرا: python benchmarks/fake_telegram.py --port 8091 --latency 0.05 --flood-rate 0.01
+# سپس: TELEGRAM_BASE_URL=http://127.0.0.1:8091/bot python crypto_bot.py
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+class FakeTelegram:
+    BOT = {'id': 1000000, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+
+    def __init__(self, latency=0.0, flood_rate=0.0, retry_after=1, seed=1):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.message_ids = itertools.count(1)
+        self.stats = Counter()
+        self.sent = []  # (time.monotonic(), chat_id, text) هر sendMessage موفق
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+            self.sent = []
+
+    def message(self, params):
+        chat_id = int(params.get('chat_id', 0))
+        return {
+            'message_id': int(params.get('message_id') or next(self.message_ids)),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': self.BOT,
+            'text': params.get('text', '')
+        }
+
+    def handle(self, method, params):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            flood = self.random.random() < self.flood_rate
+        if flood and method in ('sendMessage', 'editMessageText'):
+            self.stats['429'] += 1
+            return 429, {'ok': False, 'error_code': 429, 'description': f'Too Many Requests: retry after {self.retry_after}',
+                         'parameters': {'retry_after': self.retry_after}}
+        self.stats[method] += 1
+        if method == 'getMe':
+            result = self.BOT
+        elif method == 'sendMessage':
+            result = self.message(params)
+            with self.lock:
+                self.sent.append((time.monotonic(), result['chat']['id'], result['text']))
+        elif method == 'editMessageText':
+            result = self.message(params)
+        elif method == 'getUpdates':
+            time.sleep(min(float(params.get('timeout') or 0), 1))
+            result = []
+        else:
+            result = True
+        return 200, {'ok': True, 'result': result}
+
+class Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode() if length else ''
+        if 'json' in (self.headers.get('Content-Type') or ''):
+            params = json.loads(body or '{}')
+        else:
+            params = dict(parse_qsl(body))
+        status, payload = self.server.fake.handle(self.path.rsplit('/', 1)[-1], params)
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST
+
+    def log_message(self, format, *args):
+        pass
+
+# شروع سرور در یک رشته پس‌زمینه؛ آدرس برگشتی برای TELEGRAM_BASE_URL است
+def serve(host='127.0.0.1', port=0, **options):
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.fake = FakeTelegram(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/bot"
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8091)
+    parser.add_argument('--latency', type=float, default=0.0, help='تأخیر هر پاسخ (ثانیه)')
+    parser.add_argument('--flood-rate', type=float, default=0.0, help='نسبت پاسخ‌های 429 به ارسال پیام')
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+
+    server, url = serve(args.host, args.port, latency=args.latency, flood_rate=args.flood_rate,
+                        retry_after=args.retry_after)
+    print(f"fake Telegram Bot API listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(f"requests: {dict(server.fake.stats)}")
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
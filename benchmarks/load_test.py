@@ -0,0 +1,235 @@
+# آزمون بار سرتاسری ربات با سرورهای آزمایشی تلگرام و CoinGecko و یک PostgreSQL محلی
+# جمعیت مصنوعی کاربران و هشدارها ساخته می‌شود و سپس پاسخ‌دهنده‌ها، بررسی هشدارها و گزارش روزانه اندازه‌گیری می‌شوند
+# اجرا: DATABASE_URL=postgresql://localhost/crypto_bench python benchmarks/load_test.py --users 100000 --alerts 1000000
+# هشدار: جدول‌های ربات در DATABASE_URL خالی می‌شوند؛ فقط با دیتابیس آزمایشی اجرا کنید
+import argparse
+import asyncio
+import io
+import logging
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def report(name, timings, elapsed=None, unit=1000, suffix='ms'):
+    rate = f"{len(timings) / elapsed:>9.0f}/s" if elapsed else ' ' * 11
+    print(f"{name:<22} {len(timings):>8} {rate} p50 {percentile(timings, 0.5) * unit:>9.1f}{suffix} "
+          f"p99 {percentile(timings, 0.99) * unit:>9.1f}{suffix} max {max(timings, default=0) * unit:>9.1f}{suffix}")
+
+# ساخت جمعیت مصنوعی با COPY؛ هدف هشدارها تا spread درصد بالا یا پایین قیمت فعلی است
+def populate(cb, args, prices):
+    rng = random.Random(args.seed)
+    coins = list(prices)
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    with conn, conn.cursor() as cur:
+        cur.execute("TRUNCATE users, alerts, alert_outbox, price_history RESTART IDENTITY CASCADE")
+        users = io.StringIO()
+        for user_id in range(1, args.users + 1):
+            lang = 'fa' if user_id % 2 else 'en'
+            daily = 't' if rng.random() < args.daily_fraction else 'f'
+            users.write(f"{user_id}\t{lang}\t{daily}\tUser\t{user_id}\n")
+        users.seek(0)
+        cur.copy_expert("COPY users (user_id, lang, daily_report, first_name, last_name) FROM STDIN", users)
+        alerts = io.StringIO()
+        for _ in range(args.alerts):
+            coin = rng.choice(coins)
+            price = prices[coin]
+            alerts.write(f"{rng.randint(1, args.users)}\t{coin}\t{price * rng.uniform(1 - args.spread, 1 + args.spread)}\t{price}\n")
+        alerts.seek(0)
+        cur.copy_expert("COPY alerts (user_id, coin, price, original_price) FROM STDIN", alerts)
+    conn.close()
+
+def user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': 'User', 'last_name': str(user_id)}
+
+def message_update(update_id, user_id, text):
+    update = {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': int(time.time()), 'chat': {'id': user_id, 'type': 'private'},
+        'from': user(user_id), 'text': text
+    }}
+    if text.startswith('/'):
+        update['message']['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return update
+
+def callback_update(update_id, user_id, data):
+    return {'update_id': update_id, 'callback_query': {
+        'id': str(update_id), 'from': user(user_id), 'chat_instance': str(user_id), 'data': data,
+        'message': {'message_id': update_id, 'date': int(time.time()), 'chat': {'id': user_id, 'type': 'private'},
+                    'from': {'id': 1000000, 'is_bot': True, 'first_name': 'FakeBot'}, 'text': 'menu'}
+    }}
+
+# هر عمل یک یا چند به‌روزرسانی پشت سر هم از یک کاربر است
+def make_action(kind, update_id, user_id, coin, price):
+    if kind == 'start':
+        return [message_update(update_id, user_id, '/start')]
+    if kind == 'set_alert':
+        return [callback_update(update_id, user_id, f'alert_{coin}'),
+                message_update(update_id + 1, user_id, f"{price * 1.5:.2f}")]
+    if kind == 'price':
+        return [callback_update(update_id, user_id, f'price_{coin}')]
+    if kind == 'menu_page':
+        return [callback_update(update_id, user_id, 'price_1')]
+    return [callback_update(update_id, user_id, kind)]
+
+async def bench_handlers(cb, application, args, prices):
+    from telegram import Update
+    kinds = ['start', 'price', 'menu_page', 'alerts_list', 'my_data', 'set_alert']
+    rng = random.Random(args.seed + 1)
+    coins = list(prices)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    timings = defaultdict(list)
+
+    async def run(kind, updates):
+        async with semaphore:
+            start = time.perf_counter()
+            for update in updates:
+                await application.process_update(Update.de_json(update, application.bot))
+            timings[kind].append(time.perf_counter() - start)
+
+    actions = []
+    for i in range(args.updates):
+        kind = rng.choice(kinds)
+        coin = rng.choice(coins)
+        actions.append(run(kind, make_action(kind, 2 * i + 1, rng.randint(1, args.users), coin, prices[coin])))
+    start = time.perf_counter()
+    await asyncio.gather(*actions)
+    elapsed = time.perf_counter() - start
+    report('handlers (all)', [t for values in timings.values() for t in values], elapsed)
+    for kind in kinds:
+        report(f"  {kind}", timings[kind])
+
+# قیمت‌ها در نیمه اول به اندازه drift بالا و در نیمه دوم به همان اندازه زیر قیمت اولیه می‌روند
+def tick_prices(base, tick, ticks, drift):
+    half = max(ticks // 2, 1)
+    level = drift * (tick + 1) / half if tick < half else drift - 2 * drift * (tick + 1 - half) / max(ticks - half, 1)
+    return {coin: price * (1 + level) for coin, price in base.items()}
+
+async def wait_for_outbox(cb, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        row = await cb.storage.fetchone("SELECT count(*) AS pending FROM alert_outbox")
+        if not row['pending']:
+            return True
+        await asyncio.sleep(0.2)
+    return False
+
+async def bench_alerts(cb, bot, fake, args, prices):
+    fake.reset()
+    cb.alert_outbox.start(bot)
+    fired_at = {}
+    timings = []
+    start = time.perf_counter()
+    for tick in range(args.ticks):
+        current = tick_prices(prices, tick, args.ticks, args.drift)
+        now = time.monotonic()
+        for alert in cb.storage.alert_index.triggered(current):
+            fired_at.setdefault(int(alert.user_id), now)
+        data = {coin: {'usd': price, 'usd_24h_change': 0.0} for coin, price in current.items()}
+        tick_start = time.perf_counter()
+        await cb.check_alerts(bot, data, reschedule=False)
+        timings.append(time.perf_counter() - tick_start)
+        await asyncio.sleep(args.tick_interval)
+    drained = await wait_for_outbox(cb, args.drain_timeout)
+    if cb.send_queue.queue is not None:
+        await cb.send_queue.queue.join()
+    elapsed = time.perf_counter() - start
+    delays = {}
+    for received, chat_id, _ in fake.sent:
+        if chat_id in fired_at and chat_id not in delays:
+            delays[chat_id] = received - fired_at[chat_id]
+    report('check_alerts tick', timings)
+    report('alert fire delay', list(delays.values()))
+    print(f"{'':<22} fired users={len(fired_at)} messages={len(fake.sent)} ({len(fake.sent) / elapsed:.0f}/s) "
+          f"429s={fake.stats['429']}"
+          f"{'' if drained else ' (outbox not drained)'}")
+
+async def bench_daily(cb, bot, fake):
+    fake.reset()
+    context = type('Context', (), {'bot': bot})()
+    start = time.perf_counter()
+    await cb.daily_report(context)
+    elapsed = time.perf_counter() - start
+    print(f"{'daily_report':<22} {len(fake.sent):>8} {len(fake.sent) / elapsed:>9.0f}/s total {elapsed:.1f}s "
+          f"429s={fake.stats['429']}")
+
+async def run(cb, args, cg_server, tg_server, prices):
+    application = cb.build_application()
+    async with application:
+        load_start = time.perf_counter()
+        await cb.storage.resync()
+        print(f"snapshot load: {time.perf_counter() - load_start:.1f}s users={len(cb.storage.users)} "
+              f"alerts={len(cb.storage.alert_index.by_id)}")
+        if 'handlers' in args.scenarios:
+            await bench_handlers(cb, application, args, prices)
+        if 'alerts' in args.scenarios:
+            await bench_alerts(cb, application.bot, tg_server.fake, args, prices)
+        if 'daily' in args.scenarios:
+            await bench_daily(cb, application.bot, tg_server.fake)
+        await cb.close_services()
+    print(f"CoinGecko responses: {dict(cg_server.fake.stats)}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--alerts', type=int, default=100000)
+    parser.add_argument('--spread', type=float, default=0.05, help='حداکثر فاصله نسبی هدف هشدارها از قیمت')
+    parser.add_argument('--daily-fraction', type=float, default=0.1, help='نسبت کاربران مشترک گزارش روزانه')
+    parser.add_argument('--updates', type=int, default=2000, help='تعداد عمل‌های کاربر در آزمون پاسخ‌دهنده‌ها')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--ticks', type=int, default=20)
+    parser.add_argument('--tick-interval', type=float, default=0.5)
+    parser.add_argument('--drift', type=float, default=0.005, help='حداکثر تغییر نسبی قیمت در آزمون هشدارها')
+    parser.add_argument('--drain-timeout', type=float, default=120)
+    parser.add_argument('--send-rate', type=float, default=1000, help='سقف ارسال پیام در ثانیه (SEND_RATE)')
+    parser.add_argument('--cg-port', type=int, default=18090)
+    parser.add_argument('--tg-port', type=int, default=18091)
+    parser.add_argument('--cg-latency', type=float, default=0.02)
+    parser.add_argument('--cg-rate-limit', type=int, default=0)
+    parser.add_argument('--tg-latency', type=float, default=0.01)
+    parser.add_argument('--tg-flood-rate', type=float, default=0.0)
+    parser.add_argument('--scenarios', default='handlers,alerts,daily')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    if 'DATABASE_URL' not in os.environ:
+        sys.exit("DATABASE_URL must point to a throwaway PostgreSQL database")
+
+    # تنظیمات ربات هنگام import خوانده می‌شوند، پس آدرس سرورهای آزمایشی پیش از آن در محیط قرار می‌گیرد
+    os.environ.update({
+        'COINGECKO_API': f"http://127.0.0.1:{args.cg_port}/api/v3",
+        'TELEGRAM_BASE_URL': f"http://127.0.0.1:{args.tg_port}/bot",
+        'TELEGRAM_TOKEN': '1000000:FAKE',
+        'SEND_RATE': str(args.send_rate)
+    })
+    import crypto_bot as cb
+    from fake_coingecko import serve as serve_coingecko
+    from fake_telegram import serve as serve_telegram
+    logging.getLogger('crypto_bot').setLevel(logging.WARNING)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    cg_server, _ = serve_coingecko(port=args.cg_port, latency=args.cg_latency, rate_limit=args.cg_rate_limit)
+    tg_server, _ = serve_telegram(port=args.tg_port, latency=args.tg_latency, flood_rate=args.tg_flood_rate)
+    prices = {coin: cg_server.fake.prices[coin] for coin in cb.CURRENCIES}
+    cb.storage.open(load=False)
+    populate_start = time.perf_counter()
+    populate(cb, args, prices)
+    print(f"populated users={args.users} alerts={args.alerts} in {time.perf_counter() - populate_start:.1f}s")
+    try:
+        asyncio.run(run(cb, args, cg_server, tg_server, prices))
+    finally:
+        cb.storage.close()
+        cg_server.shutdown()
+        tg_server.shutdown()
+
+if __name__ == '__main__':
+    main()
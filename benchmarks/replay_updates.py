@@ -0,0 +1,74 @@
+# ارسال دوباره به‌روزرسانی‌های ضبط‌شده تلگرام به وب‌هوک ربات برای آزمایش محلی و اندازه‌گیری زمان پاسخ
+# فایل ورودی آرایه JSON یا یک به‌روزرسانی در هر خط است؛ بدون فایل، پیام /start از کاربران مصنوعی ساخته می‌شود
+# اجرا: python benchmarks/replay_updates.py --url http://127.0.0.1:8080/telegram --secret s3 updates.jsonl
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+
+import httpx
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        text = f.read().strip()
+    if text.startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def synthetic(count, users):
+    updates = []
+    for update_id in range(1, count + 1):
+        user = {'id': 100000 + update_id % users, 'is_bot': False, 'first_name': f'User{update_id % users}'}
+        updates.append({
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user['id'], 'type': 'private'},
+                'from': user,
+                'text': '/start',
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}]
+            }
+        })
+    return updates
+
+async def replay(args, updates):
+    headers = {'X-Telegram-Bot-Api-Secret-Token': args.secret} if args.secret else {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    statuses = Counter()
+    timings = []
+
+    async def post(client, update):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.post(args.url, json=update, headers=headers)
+                statuses[response.status_code] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            timings.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    async with httpx.AsyncClient(timeout=30) as client:
+        await asyncio.gather(*(post(client, update) for update in updates))
+    elapsed = time.perf_counter() - start
+    timings.sort()
+    print(f"updates={len(updates)} concurrency={args.concurrency} elapsed={elapsed:.2f}s rate={len(updates) / elapsed:.0f}/s")
+    print(f"status={dict(statuses)} p50={timings[len(timings) // 2] * 1000:.1f}ms "
+          f"p99={timings[min(int(len(timings) * 0.99), len(timings) - 1)] * 1000:.1f}ms")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', nargs='?', help='فایل به‌روزرسانی‌های ضبط‌شده')
+    parser.add_argument('--url', default='http://127.0.0.1:8080/telegram')
+    parser.add_argument('--secret', default='')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--count', type=int, default=1000, help='تعداد به‌روزرسانی مصنوعی')
+    parser.add_argument('--users', type=int, default=100, help='تعداد کاربران مصنوعی')
+    args = parser.parse_args()
+    updates = load(args.path) if args.path else synthetic(args.count, args.users)
+    asyncio.run(replay(args, updates))
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,101 @@
+import asyncio
+import bisect
+import json
 import logging
 import os
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import random
+import re
+import signal
+import socket
+import sys
+import threading
+import time
+from array import array
+from collections import Counter, deque, namedtuple
+from functools import lru_cache, wraps
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
-import requests
+import httpx
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from datetime import datetime
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool
+try:
+    import numpy as np
+except ImportError:  # موتور برداری هشدارها اختیاری است
+    np = None
+try:
+    import websockets
+except ImportError:  # جریان قیمت وب‌سوکت اختیاری است
+    websockets = None
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
 
 # تنظیمات لاگینگ
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # تنظیمات ثابت
-COINGECKO_API = "https://api.coingecko.com/api/v3"
+TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN', '')  # توکن ربات تلگرام (الزامی)
+TELEGRAM_BASE_URL = os.getenv('TELEGRAM_BASE_URL', 'https://api.telegram.org/bot')  # آدرس Bot API (برای سرور آزمایشی قابل تغییر است)
+TELEGRAM_CONCURRENT_UPDATES = int(os.getenv('TELEGRAM_CONCURRENT_UPDATES', 32))  # تعداد پیام‌های تلگرام که هم‌زمان پردازش می‌شوند
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # آدرس عمومی ربات برای وب‌هوک (خالی = long polling)
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')  # مسیر دریافت پیام‌های تلگرام
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')  # مقدار سرآیند X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))  # حداکثر اتصال هم‌زمان تلگرام به وب‌هوک
+HTTP_HOST = os.getenv('HTTP_HOST', '0.0.0.0')  # نشانی سرور HTTP داخلی
+PORT = int(os.getenv('PORT', 8080))  # پورت سرور HTTP داخلی (Heroku مقدار PORT را تعیین می‌کند)
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))  # پورت سرور جداگانه متریک‌ها و پروفایلر (صفر = خاموش)
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', 60))  # حداکثر مدت یک نمونه‌برداری پروفایلر (ثانیه)
+COINGECKO_API = os.getenv('COINGECKO_API', "https://api.coingecko.com/api/v3")  # آدرس API (برای سرور آزمایشی قابل تغییر است)
 CHECK_INTERVAL = 60  # چک کردن هر 1 دقیقه
+POLL_FAST_INTERVAL = int(os.getenv('POLL_FAST_INTERVAL', 15))  # فاصله دریافت قیمت ارزهای نزدیک به هدف هشدار (ثانیه)
+POLL_SLOW_INTERVAL = int(os.getenv('POLL_SLOW_INTERVAL', 180))  # فاصله دریافت قیمت ارزهای دور از هدف (ثانیه)
+POLL_NEAR_DISTANCE = float(os.getenv('POLL_NEAR_DISTANCE', 0.01))  # فاصله نسبی تا هدف برای دریافت سریع
+POLL_FAR_DISTANCE = float(os.getenv('POLL_FAR_DISTANCE', 0.05))  # فاصله نسبی تا هدف برای دریافت کند
 USD_TO_IRR = 930000  # نرخ تبدیل دلار به ریال
+PRICE_CACHE_TTL = int(os.getenv('PRICE_CACHE_TTL', 30))  # مدت اعتبار قیمت‌های کش‌شده (ثانیه)
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 10))  # مهلت درخواست‌های HTTP (ثانیه)
+HTTP_MAX_CONCURRENCY = int(os.getenv('HTTP_MAX_CONCURRENCY', 8))  # حداکثر درخواست هم‌زمان به CoinGecko
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', 5))  # تعداد خطای پیاپی تا قطع موقت درخواست‌ها به CoinGecko
+BREAKER_RESET = float(os.getenv('BREAKER_RESET', 30))  # مهلت اولیه قطع پیش از درخواست آزمایشی (ثانیه)
+BREAKER_MAX_RESET = float(os.getenv('BREAKER_MAX_RESET', 600))  # سقف مهلت قطع پس از دو برابر شدن‌های پیاپی (ثانیه)
+PRICE_STALE_MAX_AGE = int(os.getenv('PRICE_STALE_MAX_AGE', 3600))  # حداکثر عمر آخرین قیمت معتبر برای نمایش هنگام قطعی (ثانیه)
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 1))  # حداقل اتصال‌های باز به دیتابیس
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 10))  # حداکثر اتصال‌های هم‌زمان به دیتابیس
+SNAPSHOT_BATCH_SIZE = int(os.getenv('SNAPSHOT_BATCH_SIZE', 10000))  # تعداد سطر دریافتی در هر نوبت هنگام بارگذاری کامل
+SEND_WORKERS = int(os.getenv('SEND_WORKERS', 16))  # تعداد کارگرهای هم‌زمان ارسال پیام
+SEND_RATE = float(os.getenv('SEND_RATE', 25))  # حداکثر پیام در ثانیه (سقف تلگرام حدود ۳۰ است)
+SEND_PER_CHAT_INTERVAL = float(os.getenv('SEND_PER_CHAT_INTERVAL', 1.0))  # حداقل فاصله دو پیام به یک چت (ثانیه)
+SEND_MAX_ATTEMPTS = int(os.getenv('SEND_MAX_ATTEMPTS', 5))  # حداکثر تلاش برای ارسال یک پیام
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', 4))  # تعداد کارگرهای ارسال هشدارهای صف خروجی
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 100))  # تعداد هشدار برداشته‌شده از صف در هر نوبت
+OUTBOX_LEASE = int(os.getenv('OUTBOX_LEASE', 120))  # مدت رزرو هشدار برای یک کارگر پیش از واگذاری به دیگری (ثانیه)
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 5))  # فاصله بررسی صف وقتی هشدار تازه‌ای اعلام نشده (ثانیه)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 10))  # حداکثر دفعات برداشتن یک هشدار از صف پیش از کنار گذاشتن
+ALERT_TABLE_PARTITIONS = int(os.getenv('ALERT_TABLE_PARTITIONS', 0))  # تعداد پارتیشن hash جدول alerts روی coin (صفر = بدون پارتیشن؛ پس از اعمال ثابت می‌ماند)
+ALERT_PARTITIONS = int(os.getenv('ALERT_PARTITIONS', 16))  # تعداد بخش‌های ارزها میان فرایندهای کارگر هشدار
+PARTITION_LEASE = int(os.getenv('PARTITION_LEASE', 30))  # مدت اعتبار رزرو هر بخش بدون تمدید (ثانیه)
+TOPOLOGY_WAIT = float(os.getenv('TOPOLOGY_WAIT', 60))  # انتظار برای خروج فرایند ناسازگار قبلی هنگام شروع (ثانیه)
+PARTITION_RESYNC_INTERVAL = int(os.getenv('PARTITION_RESYNC_INTERVAL', 60))  # فاصله بارگذاری کامل هشدارهای بخش‌ها (ثانیه)
+ALERT_ENGINE = os.getenv('ALERT_ENGINE', 'bisect')  # موتور بررسی هشدارها: bisect یا numpy
+SEARCH_RESULTS = int(os.getenv('SEARCH_RESULTS', 5))  # حداکثر تعداد نتایج جستجو
+BULK_ALERTS_MAX = int(os.getenv('BULK_ALERTS_MAX', 50))  # حداکثر تعداد هشدار در یک پیام
+ITEMS_PER_PAGE = 10  # تعداد ارز در هر صفحه منو
+COIN_LIST_PATH = os.getenv('COIN_LIST_PATH', 'coins.json')  # فایل کش فهرست کامل ارزهای CoinGecko
+COIN_LIST_REFRESH_HOURS = int(os.getenv('COIN_LIST_REFRESH_HOURS', 24))  # فاصله به‌روزرسانی فهرست ارزها
+COIN_LIST_SYNC_MINUTES = int(os.getenv('COIN_LIST_SYNC_MINUTES', 10))  # فاصله بررسی فهرست مشترک ارزها در دیتابیس
+COINGECKO_BATCH_SIZE = int(os.getenv('COINGECKO_BATCH_SIZE', 250))  # حداکثر تعداد ارز در هر درخواست قیمت
+COINGECKO_MAX_IDS_LENGTH = int(os.getenv('COINGECKO_MAX_IDS_LENGTH', 1800))  # حداکثر طول پارامتر ids در هر درخواست
+PRICE_SOURCE = os.getenv('PRICE_SOURCE', 'coingecko')  # منبع قیمت: coingecko یا binance یا simulated
+BINANCE_WS_URL = os.getenv('BINANCE_WS_URL', 'wss://stream.binance.com:9443/ws/!miniTicker@arr')  # جریان قیمت صرافی
+BINANCE_STALE_SECONDS = float(os.getenv('BINANCE_STALE_SECONDS', 60))  # بعد از این مدت بی‌خبری از یک جفت، ارز از CoinGecko دریافت می‌شود
+SIMULATED_FEED_PATH = os.getenv('SIMULATED_FEED_PATH', '')  # فایل تیک‌های ضبط‌شده برای پخش دوباره (خالی = تیک مصنوعی)
+SIMULATED_FEED_INTERVAL = float(os.getenv('SIMULATED_FEED_INTERVAL', 1.0))  # فاصله تیک‌های مصنوعی (ثانیه)
+SIMULATED_FEED_VOLATILITY = float(os.getenv('SIMULATED_FEED_VOLATILITY', 0.002))  # نوسان نسبی هر تیک مصنوعی
+PRICE_HISTORY_INTERVAL = float(os.getenv('PRICE_HISTORY_INTERVAL', 10))  # حداقل فاصله ذخیره قیمت هر ارز در تاریخچه (ثانیه)
 
 # لیست 100 ارز دیجیتال محبوب
 CURRENCIES = {
@@ -149,6 +229,16 @@ COIN_SYMBOLS = {
     'nkn': 'NKN'
 }
 
+# جفت بازار بایننس ارزهای منتخب بر اساس شناسه CoinGecko (نه نماد، چون نماد بین توکن‌ها تکراری است)
+# جفت‌هایی که بایننس ندارد یا حذف کرده هرگز در جریان نمی‌آیند و آن ارزها از CoinGecko دریافت می‌شوند
+BINANCE_PAIRS = {
+    **{coin: f"{symbol}USDT" for coin, symbol in COIN_SYMBOLS.items() if symbol != 'USDT'},
+    'terra-luna': 'LUNCUSDT',  # terra-luna در CoinGecko ترا کلاسیک است و LUNAUSDT بایننس ترا ۲
+    'render-token': 'RENDERUSDT',  # نماد RNDR در بایننس به RENDER تغییر کرده است
+}
+
+DAILY_REPORT_COINS = list(CURRENCIES)[:10]  # ارزهای گزارش روزانه
+
 # دیکشنری زبان‌ها
 LANGUAGES = {
     'en': {
@@ -165,6 +255,7 @@ LANGUAGES = {
         'my_data': "My Data",
         'current_price': "📊 Current {coin} Price: ${price}",
         'change_24h': "📈 24h Change: {change}%",
+        'stale_price': "⏳ Live prices are temporarily unavailable; showing the last known price from {minutes} min ago.",
         'price_in_irr': "💵 {coin} Price in IRR: {price_irr:,} IRR",
         'alert_set': "✅ Alert set for {coin} at ${price}",
         'alert_triggered': "⚠️ {coin} reached ${price}!\nCurrent price: ${current}",
@@ -175,6 +266,17 @@ LANGUAGES = {
         'delete_alert': "Delete",
         'delete_menu': "Which alert do you want to delete?",
         'alert_deleted': "Alert deleted!",
+        'delete_all': "Delete All",
+        'alerts_deleted': "{count} alerts deleted!",
+        'bulk_alerts': "Add Several Alerts",
+        'bulk_prompt': (
+            "Send one alert per line: the coin, then one or more target prices "
+            "or a change from the current price in percent.\n"
+            "Example:\nbitcoin 70000\nETH 3500 4000\nsolana -10%"
+        ),
+        'alerts_added': "✅ {count} alerts set:\n{alerts}",
+        'alerts_invalid': "⚠️ Not understood or price unavailable:\n{entries}",
+        'bulk_limit': "At most {limit} alerts can be set in one message.",
         'chart_link': "View {coin} chart: {url}",
         'daily_on': "ON",
         'daily_off': "OFF",
@@ -184,6 +286,7 @@ LANGUAGES = {
         'search_prompt': "Enter coin name (English or Persian):",
         'search_result': "Found: {coin}",
         'search_no_result': "No coin found!",
+        'search_results': "Found {count} coins:",
         'prev_page': "Previous",
         'next_page': "Next",
         'my_data_title': "Your Data ({last_name}):",
@@ -202,7 +305,7 @@ LANGUAGES = {
             "Crypto Bot Help:\n"
             "- /start: Start the bot and see the main menu\n"
             "- Prices: View current prices of cryptocurrencies\n"
-            "- Set Alert: Set a price alert for a coin\n"
+            "- Set Alert: Set a price alert for a coin (several prices or a percentage like +5% also work)\n"
             "- View Alerts: See and manage your alerts\n"
             "- Chart: Get a chart link for a coin\n"
             "- Daily Report: Toggle daily price reports\n"
@@ -228,6 +331,7 @@ LANGUAGES = {
         'my_data': "داده‌های من",
         'current_price': "📊 قیمت فعلی {coin}: ${price}",
         'change_24h': "📈 تغییر ۲۴ ساعته: {change}%",
+        'stale_price': "⏳ قیمت لحظه‌ای موقتاً در دسترس نیست؛ آخرین قیمت موجود مربوط به {minutes} دقیقه پیش است.",
         'price_in_irr': "💵 قیمت {coin} به ریال: {price_irr:,} IRR",
         'alert_set': "✅ هشدار برای {coin} در ${price} تنظیم شد",
         'alert_triggered': "⚠️ {coin} به ${price} رسید!\nقیمت فعلی: ${current}",
@@ -238,6 +342,17 @@ LANGUAGES = {
         'delete_alert': "حذف",
         'delete_menu': "کدام هشدار را می‌خواهید حذف کنید؟",
         'alert_deleted': "هشدار حذف شد!",
+        'delete_all': "حذف همه",
+        'alerts_deleted': "{count} هشدار حذف شد!",
+        'bulk_alerts': "افزودن چند هشدار",
+        'bulk_prompt': (
+            "در هر خط یک هشدار بفرستید: نام ارز و سپس یک یا چند قیمت هدف "
+            "یا درصد تغییر نسبت به قیمت فعلی.\n"
+            "مثال:\nbitcoin 70000\nETH 3500 4000\nsolana -10%"
+        ),
+        'alerts_added': "✅ {count} هشدار تنظیم شد:\n{alerts}",
+        'alerts_invalid': "⚠️ نامفهوم یا بدون قیمت:\n{entries}",
+        'bulk_limit': "در هر پیام حداکثر {limit} هشدار می‌توان تنظیم کرد.",
         'chart_link': "مشاهده نمودار {coin}: {url}",
         'daily_on': "روشن",
         'daily_off': "خاموش",
@@ -247,6 +362,7 @@ LANGUAGES = {
         'search_prompt': "نام ارز را وارد کنید (فارسی یا انگلیسی):",
         'search_result': "پیدا شد: {coin}",
         'search_no_result': "ارزی پیدا نشد!",
+        'search_results': "{count} ارز پیدا شد:",
         'prev_page': "قبلی",
         'next_page': "بعدی",
         'my_data_title': "داده‌های شما ({last_name}):",
@@ -265,7 +381,7 @@ LANGUAGES = {
             "راهنمایی ربات کریپتو:\n"
             "- /start: شروع ربات و نمایش منوی اصلی\n"
             "- قیمت ارز: مشاهده قیمت فعلی ارزهای دیجیتال\n"
-            "- تنظیم هشدار: تنظیم هشدار قیمت برای یک ارز\n"
+            "- تنظیم هشدار: تنظیم هشدار قیمت برای یک ارز (چند قیمت یا درصدی مثل +5% هم پذیرفته می‌شود)\n"
             "- مشاهده هشدارها: دیدن و مدیریت هشدارهای شما\n"
             "- نمودار: دریافت لینک نمودار یک ارز\n"
             "- گزارش روزانه: روشن/خاموش کردن گزارش روزانه قیمت‌ها\n"
@@ -279,155 +395,2272 @@ LANGUAGES = {
     }
 }
 
+# کلاس‌های متریک با قالب متنی Prometheus
+# هر متریک مقدارها را بر اساس برچسب‌ها (به ترتیب labels) نگه می‌دارد
+class CounterMetric:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def format_labels(self, key, le=None):
+        pairs = [f'{label}="{value}"' for label, value in zip(self.labels, key)]
+        if le is not None:
+            pairs.append(f'le="{le}"')
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield f"{self.name}{self.format_labels(key)} {value}"
+
+class GaugeMetric(CounterMetric):
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), read=None):
+        super().__init__(name, help, labels)
+        self.read = read  # تابعی که هنگام خواندن متریک مقدار فعلی را برمی‌گرداند
+
+    def set(self, value, **labels):
+        self.values[self.key(labels)] = value
+
+    def samples(self):
+        if self.read is not None:
+            self.values[()] = self.read()
+        return super().samples()
+
+class HistogramMetric(CounterMetric):
+    kind = 'histogram'
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * len(self.buckets), 0, 0.0]  # شمارش هر سطل، تعداد، مجموع
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            entry[0][i] += 1
+        entry[1] += 1
+        entry[2] += value
+
+    def time(self, **labels):
+        return MetricTimer(self, labels)
+
+    def samples(self):
+        for key, (counts, count, total) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{self.format_labels(key, bound)} {cumulative}"
+            yield f"{self.name}_bucket{self.format_labels(key, '+Inf')} {count}"
+            yield f"{self.name}_count{self.format_labels(key)} {count}"
+            yield f"{self.name}_sum{self.format_labels(key)} {total}"
+
+class MetricTimer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(CounterMetric(name, help, labels))
+
+    def gauge(self, name, help, labels=(), read=None):
+        return self.register(GaugeMetric(name, help, labels, read))
+
+    def histogram(self, name, help, labels=(), buckets=HistogramMetric.BUCKETS):
+        return self.register(HistogramMetric(name, help, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+COINGECKO_REQUESTS = metrics.counter('coingecko_requests_total', 'CoinGecko requests by endpoint and outcome', ('endpoint', 'status'))
+COINGECKO_SECONDS = metrics.histogram('coingecko_request_seconds', 'CoinGecko request latency', ('endpoint',))
+ALERT_TICK_SECONDS = metrics.histogram('alert_tick_seconds', 'Duration of one price batch evaluation')
+ALERT_COINS_EVALUATED = metrics.counter('alert_coins_evaluated_total', 'Coin prices evaluated against alerts')
+ALERTS_EVALUATED = metrics.counter('alerts_evaluated_total', 'Active alerts on the coins of evaluated price batches')
+ALERTS_FIRED = metrics.counter('alerts_fired_total', 'Alerts claimed into the outbox')
+DB_SECONDS = metrics.histogram('db_query_seconds', 'Database operation latency', ('op',))
+DB_ERRORS = metrics.counter('db_errors_total', 'Failed database operations', ('op',))
+HANDLER_SECONDS = metrics.histogram('handler_seconds', 'Telegram handler latency', ('handler',))
+HANDLER_ERRORS = metrics.counter('handler_errors_total', 'Telegram handler exceptions', ('handler',))
+TELEGRAM_SEND_SECONDS = metrics.histogram('telegram_send_seconds', 'Telegram sendMessage latency')
+TELEGRAM_MESSAGES = metrics.counter('telegram_messages_total', 'Telegram messages by final result', ('result',))
+
+# نمونه‌بردار پشته‌ها: در یک رشته جدا هر interval ثانیه پشته همه رشته‌ها خوانده
+# و به قالب collapsed (قابل استفاده در flamegraph) شمرده می‌شود؛ سربار فقط در مدت نمونه‌برداری است
+def sample_stacks(seconds, interval=0.005):
+    stacks = Counter()
+    me = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            calls = []
+            while frame is not None:
+                calls.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            stacks[';'.join([names.get(ident, str(ident))] + calls[::-1])] += 1
+        time.sleep(interval)
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
+
+# کد عددی زبان در رکورد کاربران (اندیس در این تاپل)؛ زبان ناشناخته انگلیسی در نظر گرفته می‌شود
+LANG_CODES = ('en', 'fa')
+LANG_CODE = {lang: code for code, lang in enumerate(LANG_CODES)}
+
+# کلاس رکورد کاربر در حافظه: با صدها هزار کاربر، __slots__ به جای دیکشنری هر سطر حافظه را چند برابر کم می‌کند
+class UserRecord:
+    __slots__ = ('first_name', 'last_name', 'lang_code', 'daily_report')
+
+    def __init__(self, first_name, last_name, lang='en', daily_report=False):
+        self.first_name = first_name
+        self.last_name = last_name
+        self.lang_code = LANG_CODE.get(lang, 0)
+        self.daily_report = bool(daily_report)
+
+    @property
+    def lang(self):
+        return LANG_CODES[self.lang_code]
+
+    @lang.setter
+    def lang(self, lang):
+        self.lang_code = LANG_CODE.get(lang, 0)
+
+# کلاس رکورد هشدار در حافظه؛ شناسه ارز و کاربر intern می‌شوند تا هشدارهای یک ارز یا کاربر یک رشته مشترک داشته باشند
+class AlertRecord:
+    __slots__ = ('id', 'user_id', 'coin', 'price', 'original_price')
+
+    def __init__(self, id, user_id, coin, price, original_price):
+        self.id = id
+        self.user_id = sys.intern(user_id)
+        self.coin = sys.intern(coin)
+        self.price = price
+        self.original_price = original_price
+
+# کلاس ایندکس هشدارها: برای هر ارز، هشدارهای صعودی و نزولی به ترتیب قیمت هدف نگه داشته می‌شوند
+class AlertIndex:
+    def __init__(self):
+        self.above = {}  # coin -> ([target prices], [alerts]) هشدارهایی که با رسیدن قیمت به بالای هدف فعال می‌شوند
+        self.below = {}  # coin -> ([target prices], [alerts]) هشدارهایی که با رسیدن قیمت به زیر هدف فعال می‌شوند
+        self.by_id = {}
+
+    @staticmethod
+    def direction(alert):
+        if alert.price > alert.original_price:
+            return 1
+        if alert.price < alert.original_price:
+            return -1
+        return 0  # هدف برابر قیمت اولیه هرگز فعال نمی‌شود
+
+    def rebuild(self, alerts):
+        self.above, self.below, self.by_id = {}, {}, {}
+        for alert in alerts:
+            self.add(alert)
+
+    def add(self, alert):
+        direction = self.direction(alert)
+        if direction == 0 or alert.id in self.by_id:
+            return False
+        books = self.above if direction > 0 else self.below
+        targets, entries = books.setdefault(alert.coin, ([], []))
+        pos = bisect.bisect_right(targets, alert.price)
+        targets.insert(pos, alert.price)
+        entries.insert(pos, alert)
+        self.by_id[alert.id] = alert
+        return True
+
+    def remove(self, alert_id):
+        alert = self.by_id.pop(alert_id, None)
+        if alert is None:
+            return None
+        books = self.above if self.direction(alert) > 0 else self.below
+        targets, entries = books[alert.coin]
+        lo = bisect.bisect_left(targets, alert.price)
+        hi = bisect.bisect_right(targets, alert.price)
+        for i in range(lo, hi):
+            if entries[i].id == alert_id:
+                del targets[i]
+                del entries[i]
+                break
+        if not targets:
+            del books[alert.coin]
+        return alert
+
+    def coins(self):
+        return self.above.keys() | self.below.keys()
+
+    def count(self, coins):
+        return sum(len(book[coin][0]) for coin in coins for book in (self.above, self.below) if coin in book)
+
+    # فاصله نسبی قیمت فعلی تا نزدیک‌ترین هدف هشدار هر ارز
+    def distances(self, prices):
+        result = {}
+        for coin, price in prices.items():
+            if not price:
+                continue
+            gaps = []
+            book = self.above.get(coin)
+            if book:
+                gaps.append(book[0][0] - price)
+            book = self.below.get(coin)
+            if book:
+                gaps.append(price - book[0][-1])
+            if gaps:
+                result[coin] = max(min(gaps), 0) / price
+        return result
+
+    # هشدارهای صعودی با بالاترین و هشدارهای نزولی با پایین‌ترین قیمت بازه بررسی می‌شوند (بدون بازه، قیمت لحظه‌ای)
+    def triggered(self, highs, lows=None):
+        lows = highs if lows is None else lows
+        fired = []
+        for coin, high in highs.items():
+            book = self.above.get(coin)
+            if high and book:
+                fired.extend(book[1][:bisect.bisect_right(book[0], high)])
+        for coin, low in lows.items():
+            book = self.below.get(coin)
+            if low and book:
+                fired.extend(book[1][bisect.bisect_left(book[0], low):])
+        return fired
+
+# کلاس ایندکس برداری هشدارها با NumPy: ستون‌های ارز، قیمت هدف و جهت در آرایه‌ها نگه داشته می‌شوند
+# و در هر دور، همه هشدارها با یک عملیات برداری روی بردار قیمت‌ها (به ترتیب CURRENCIES) بررسی می‌شوند
+class VectorAlertIndex:
+    def __init__(self):
+        self.coin_ids = list(CURRENCIES)
+        self.coin_pos = {coin: i for i, coin in enumerate(self.coin_ids)}
+        self.rebuild([])
+
+    def rebuild(self, alerts):
+        self.by_id = {}
+        self.coin_counts = Counter()
+        self.row_of = {}
+        self.ids = np.empty(0, dtype=np.int64)
+        self.coin_idx = np.empty(0, dtype=np.int32)
+        self.target = np.empty(0, dtype=np.float64)
+        self.direction = np.empty(0, dtype=np.int8)
+        self.active = np.empty(0, dtype=bool)
+        self.pending = []
+        for alert in alerts:
+            self.add(alert)
+        self.compact()
+
+    def add(self, alert):
+        direction = AlertIndex.direction(alert)
+        if direction == 0 or alert.id in self.by_id:
+            return False
+        if alert.coin not in self.coin_pos:
+            self.coin_pos[alert.coin] = len(self.coin_ids)
+            self.coin_ids.append(alert.coin)
+        self.by_id[alert.id] = alert
+        self.coin_counts[alert.coin] += 1
+        self.pending.append((alert.id, self.coin_pos[alert.coin], alert.price, direction))
+        return True
+
+    def remove(self, alert_id):
+        alert = self.by_id.pop(alert_id, None)
+        if alert is None:
+            return None
+        self.coin_counts[alert.coin] -= 1
+        if not self.coin_counts[alert.coin]:
+            del self.coin_counts[alert.coin]
+        row = self.row_of.pop(alert_id, None)
+        if row is not None:
+            self.active[row] = False
+        else:
+            self.pending = [item for item in self.pending if item[0] != alert_id]
+        return alert
+
+    # ادغام هشدارهای جدید با آرایه‌ها و حذف ردیف‌های غیرفعال
+    def compact(self):
+        keep = self.active
+        ids, coin_idx, target, direction = self.ids[keep], self.coin_idx[keep], self.target[keep], self.direction[keep]
+        if self.pending:
+            new_ids, new_coins, new_targets, new_directions = zip(*self.pending)
+            ids = np.concatenate([ids, np.array(new_ids, dtype=np.int64)])
+            coin_idx = np.concatenate([coin_idx, np.array(new_coins, dtype=np.int32)])
+            target = np.concatenate([target, np.array(new_targets, dtype=np.float64)])
+            direction = np.concatenate([direction, np.array(new_directions, dtype=np.int8)])
+            self.pending = []
+        self.ids, self.coin_idx, self.target, self.direction = ids, coin_idx, target, direction
+        self.active = np.ones(len(ids), dtype=bool)
+        self.row_of = dict(zip(ids.tolist(), range(len(ids))))
+
+    def coins(self):
+        return self.coin_counts.keys()
+
+    def count(self, coins):
+        return sum(self.coin_counts.get(coin, 0) for coin in coins)
+
+    # بردار قیمت هم‌تراز با ستون ارزها (ارز بدون قیمت = NaN)
+    def current_prices(self, prices):
+        if self.pending or np.count_nonzero(~self.active) > len(self.active) // 10:
+            self.compact()
+        vector = np.full(len(self.coin_ids), np.nan)
+        for coin, price in prices.items():
+            pos = self.coin_pos.get(coin)
+            if pos is not None and price:
+                vector[pos] = price
+        return vector[self.coin_idx]
+
+    def distances(self, prices):
+        current = self.current_prices(prices)
+        with np.errstate(invalid='ignore'):
+            gap = np.where(self.direction > 0, self.target - current, current - self.target) / current
+        valid = self.active & np.isfinite(gap)
+        nearest = np.full(len(self.coin_ids), np.inf)
+        np.minimum.at(nearest, self.coin_idx[valid], gap[valid])
+        return {self.coin_ids[i]: max(float(nearest[i]), 0.0) for i in np.nonzero(np.isfinite(nearest))[0]}
+
+    def triggered(self, highs, lows=None):
+        high = self.current_prices(highs)
+        low = high if lows is None else self.current_prices(lows)
+        # مقایسه با NaN همیشه False است، پس ارزهای بدون قیمت فعال نمی‌شوند
+        mask = self.active & np.where(self.direction > 0, high >= self.target, low <= self.target)
+        return [self.by_id[alert_id] for alert_id in self.ids[mask].tolist()]
+
+# کلاس مجموعه ارزهای تحت نظر: شمارش ارجاع از هشدارها و گزارش روزانه، با زمان‌بندی تطبیقی دریافت قیمت هر ارز
+class WatchedCoins:
+    def __init__(self):
+        self.refs = Counter()
+        self.next_due = {}  # coin -> زمان دریافت بعدی (monotonic)
+
+    def acquire(self, coin, count=1):
+        self.refs[coin] += count
+
+    def release(self, coin, count=1):
+        self.refs[coin] -= count
+        if self.refs[coin] <= 0:
+            del self.refs[coin]
+            self.next_due.pop(coin, None)
+
+    def clear(self):
+        self.refs.clear()
+        self.next_due.clear()
+
+    def __contains__(self, coin):
+        return coin in self.refs
+
+    def __len__(self):
+        return len(self.refs)
+
+    def due(self, now):
+        return [coin for coin in self.refs if self.next_due.get(coin, 0) <= now]
+
+    # ارزهای نزدیک به هدف سریع‌تر و ارزهای دور (یا بدون هشدار) کندتر دریافت می‌شوند
+    @staticmethod
+    def interval_for(distance):
+        if distance is None or distance > POLL_FAR_DISTANCE:
+            return POLL_SLOW_INTERVAL
+        if distance > POLL_NEAR_DISTANCE:
+            return CHECK_INTERVAL
+        return POLL_FAST_INTERVAL
+
+    def reschedule(self, prices, distances, now):
+        for coin in prices:
+            if coin in self.refs:
+                self.next_due[coin] = now + self.interval_for(distances.get(coin))
+
+# کلاس بازه قیمت ارزهای تحت نظر: بالاترین و پایین‌ترین قیمت دیده‌شده از آخرین بررسی هشدارها
+# (جستجوی قیمت کاربران از کش و کندل‌های فایل شبیه‌سازی) تا عبور کوتاهی که همین فرایند دیده میان دو دریافت از دست نرود؛
+# فقط نمونه‌های همین فرایند ثبت می‌شوند، پس در نقش alerts بازه همان قیمت دریافت است و عبورهای میان دو دریافت
+# فقط با منبع جریانی (تیک‌های بایننس) دیده می‌شوند
+class PriceRanges:
+    def __init__(self, watched):
+        self.watched = watched
+        self.highs = {}
+        self.lows = {}
+
+    def observe(self, coin, low, high):
+        if coin not in self.watched or not low or not high:
+            return
+        if high > self.highs.get(coin, 0):
+            self.highs[coin] = high
+        if low < self.lows.get(coin, float('inf')):
+            self.lows[coin] = low
+
+    def observe_all(self, data):
+        for coin, prices in data.items():
+            price = prices.get('usd')
+            self.observe(coin, prices.get('usd_low') or price, prices.get('usd_high') or price)
+
+    # بازه هر ارز از قیمت‌های این دسته و قیمت‌های دیده‌شده قبلی؛ بازه ذخیره‌شده این ارزها پاک می‌شود
+    def take(self, data):
+        highs, lows = {}, {}
+        for coin, prices in data.items():
+            price = prices['usd']
+            if not price:
+                continue
+            highs[coin] = max(price, prices.get('usd_high') or price, self.highs.pop(coin, price))
+            lows[coin] = min(price, prices.get('usd_low') or price, self.lows.pop(coin, price))
+        return highs, lows
+
+    # هشدار تازه نباید با قیمتی که پیش از ثبتش دیده شده فعال شود
+    def reset(self, coin):
+        self.highs.pop(coin, None)
+        self.lows.pop(coin, None)
+
+    def clear(self):
+        self.highs.clear()
+        self.lows.clear()
+
+def make_alert_index():
+    if ALERT_ENGINE == 'numpy':
+        if np is not None:
+            return VectorAlertIndex()
+        logger.warning("NumPy نصب نیست؛ از ایندکس مرتب‌شده هشدارها استفاده می‌شود")
+    return AlertIndex()
+
+# شرط SQL تعلق ارز یک هشدار به یکی از بخش‌ها (پارامترها: تعداد بخش‌ها و لیست شماره بخش‌ها)
+PARTITION_FILTER = "mod(abs(hashtext(coin)::bigint), %s) = ANY(%s)"
+
+# مهاجرت‌های نسخه‌دار دیتابیس؛ هر مهاجرت یک بار و به ترتیب نسخه اجرا و در schema_migrations ثبت می‌شود
+# مهاجرت‌های ثبت‌شده هرگز تغییر نمی‌کنند و هر تغییر تازه شماره نسخه بعدی را می‌گیرد
+MIGRATION_LOCK = 72150521  # کلید قفل مشورتی تا فقط یک فرایند در هر لحظه مهاجرت اجرا کند
+LEADER_LOCK = 72150522  # کلید قفل مشورتی فرایند رهبر کارهای زمان‌بندی‌شده مشترک
+TOPOLOGY_LOCK = 72150523  # نقش all (انحصاری) در برابر نقش‌های تفکیک‌شده bot، web و alerts (اشتراکی)
+INGRESS_LOCK = 72150524  # دریافت با getUpdates (انحصاری، یک فرایند) در برابر وب‌هوک (اشتراکی، چند نسخه)
+Migration = namedtuple('Migration', 'version description apply enabled')
+
+# جدول‌های اولیه (با IF NOT EXISTS تا دیتابیس‌های ساخته‌شده پیش از مهاجرت‌ها هم همین نسخه را ثبت کنند)
+def create_tables(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            lang TEXT DEFAULT 'en',
+            daily_report BOOLEAN DEFAULT FALSE,
+            first_name TEXT,
+            last_name TEXT
+        );
+        CREATE TABLE IF NOT EXISTS alerts (
+            id SERIAL PRIMARY KEY,
+            user_id TEXT,
+            coin TEXT,
+            price REAL,
+            original_price REAL,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        );
+        CREATE TABLE IF NOT EXISTS price_history (
+            coin TEXT NOT NULL,
+            resolution INTEGER NOT NULL,
+            bucket TIMESTAMPTZ NOT NULL,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            PRIMARY KEY (coin, resolution, bucket)
+        );
+        CREATE TABLE IF NOT EXISTS alert_workers (
+            owner TEXT PRIMARY KEY,
+            seen TIMESTAMPTZ NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS alert_partitions (
+            partition INTEGER PRIMARY KEY,
+            owner TEXT,
+            lease_until TIMESTAMPTZ
+        );
+        CREATE TABLE IF NOT EXISTS alert_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            alert_id INTEGER UNIQUE NOT NULL,
+            user_id TEXT NOT NULL,
+            coin TEXT NOT NULL,
+            price REAL,
+            original_price REAL,
+            current_price DOUBLE PRECISION,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            lease_until TIMESTAMPTZ
+        );
+    """)
+
+# جستجوی هشدارهای هر کاربر (لیست و حذف) و مشترکان گزارش روزانه بدون پیمایش کل جدول
+def create_indexes(cur):
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS alerts_user_id_idx ON alerts (user_id, id);
+        CREATE INDEX IF NOT EXISTS users_daily_report_idx ON users (user_id) INCLUDE (lang) WHERE daily_report;
+    """)
+
+# جهت ذخیره‌شده هشدار (۱ صعودی، -۱ نزولی، ۰ هرگز) با ایندکس بازه‌ای؛ هشدارهای فعال‌شده از ایندکس حافظه
+# و با شناسه برداشته می‌شوند و هیچ پرس‌وجویی از این ایندکس استفاده نمی‌کند، پس مهاجرت ۷ هر دو را حذف می‌کند
+def add_alert_direction(cur):
+    cur.execute("""
+        ALTER TABLE alerts ADD COLUMN IF NOT EXISTS direction SMALLINT
+            GENERATED ALWAYS AS (sign(price - original_price)::smallint) STORED;
+        CREATE INDEX IF NOT EXISTS alerts_coin_direction_price_idx ON alerts (coin, direction, price);
+    """)
+
+# تبدیل جدول alerts به جدول پارتیشن‌شده با hash روی coin برای جدول‌های بسیار بزرگ
+# کلید اصلی باید ستون پارتیشن را شامل شود، پس (id, coin) می‌شود؛ شناسه‌ها همچنان از همان sequence می‌آیند
+def partition_alerts(cur):
+    cur.execute("""
+        ALTER TABLE alerts RENAME TO alerts_unpartitioned;
+        ALTER TABLE alerts_unpartitioned RENAME CONSTRAINT alerts_pkey TO alerts_unpartitioned_pkey;
+        CREATE TABLE alerts (
+            id INTEGER NOT NULL DEFAULT nextval('alerts_id_seq'),
+            user_id TEXT REFERENCES users(user_id),
+            coin TEXT NOT NULL,
+            price REAL,
+            original_price REAL,
+            PRIMARY KEY (id, coin)
+        ) PARTITION BY HASH (coin);
+    """)
+    for remainder in range(ALERT_TABLE_PARTITIONS):
+        cur.execute(
+            f"CREATE TABLE alerts_p{remainder} PARTITION OF alerts "
+            f"FOR VALUES WITH (MODULUS {ALERT_TABLE_PARTITIONS}, REMAINDER {remainder})"
+        )
+    cur.execute("""
+        INSERT INTO alerts (id, user_id, coin, price, original_price)
+        SELECT id, user_id, coin, price, original_price FROM alerts_unpartitioned WHERE coin IS NOT NULL;
+        ALTER SEQUENCE alerts_id_seq OWNED BY alerts.id;
+        DROP TABLE alerts_unpartitioned;
+        CREATE INDEX alerts_user_id_idx ON alerts (user_id, id);
+    """)
+
+# فهرست مشترک ارزهای CoinGecko (یک سطر JSON) تا همه فرایندها، حتی روی دیسک تازه و جدای هر داینو،
+# همان فهرست را داشته باشند و فقط یکی از آن‌ها فهرست را از CoinGecko بگیرد
+def create_coin_list(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS coin_list (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            coins TEXT,
+            updated_at TIMESTAMPTZ,
+            refresh_until TIMESTAMPTZ
+        );
+        INSERT INTO coin_list (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+    """)
+
+# وضعیت گفتگوی کاربر (context.user_data) برای نسخه‌های هم‌زمان ربات با وب‌هوک
+def add_user_state(cur):
+    cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS state JSONB")
+
+# حذف ستون direction و ایندکس بازه‌ای آن که فقط هزینه نوشتن در هر ثبت و حذف هشدار بودند
+def drop_alert_direction(cur):
+    cur.execute("""
+        DROP INDEX IF EXISTS alerts_coin_direction_price_idx;
+        ALTER TABLE alerts DROP COLUMN IF EXISTS direction;
+    """)
+
+MIGRATIONS = [
+    Migration(1, 'initial tables', create_tables, True),
+    Migration(2, 'user and daily report indexes', create_indexes, True),
+    Migration(3, 'stored alert direction with range index', add_alert_direction, True),
+    Migration(4, 'hash partitioning of alerts by coin', partition_alerts, ALERT_TABLE_PARTITIONS > 0),
+    Migration(5, 'shared coin list', create_coin_list, True),
+    Migration(6, 'conversation state on users', add_user_state, True),
+    Migration(7, 'drop unused alert direction index', drop_alert_direction, True),
+]
+
 # کلاس ذخیره‌سازی با دیتابیس PostgreSQL
+# کوئری‌ها با یک استخر اتصال و خارج از حلقه رویداد اجرا می‌شوند و هر عملیات تراکنش جداگانه دارد
+# هر تغییر هم در دیتابیس و هم در کش حافظه (users و alerts) اعمال می‌شود
+# در حالت چندفرایندی (shared) فرایندهای دیگر هم هشدارها را تغییر می‌دهند و partitions بخش‌های ارزهای این فرایند است
 class Storage:
-    def __init__(self):
-        self.conn = psycopg2.connect(os.getenv('DATABASE_URL'), cursor_factory=RealDictCursor)
-        self.create_tables()
-        self.load_data()
+    def __init__(self, dsn=None, min_conn=DB_POOL_MIN, max_conn=DB_POOL_MAX):
+        self.dsn = dsn
+        self.min_conn = min_conn
+        self.max_conn = max_conn
+        self.pool = None
+        self.executor = None
+        self.leader_conn = None
+        self.topology_conn = None
+        self.users = {}
+        self.alerts = {}
+        self.alert_index = make_alert_index()
+        self.watched = WatchedCoins()
+        self.ranges = PriceRanges(self.watched)
+        self.daily_subscribers = 0
+        self.shared = False
+        self.partitions = None  # None یعنی همه ارزها
+        self.load_users = True  # کارگرهای هشدار کاربران را در حافظه لازم ندارند
+        self.load_alerts = True  # نقش‌های bot و web هشدارها را بررسی نمی‌کنند
+        self.last_alert_id = 0
 
-    def create_tables(self):
-        with self.conn.cursor() as cur:
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id TEXT PRIMARY KEY,
-                    lang TEXT DEFAULT 'en',
-                    daily_report BOOLEAN DEFAULT FALSE,
-                    first_name TEXT,
-                    last_name TEXT
-                );
-                CREATE TABLE IF NOT EXISTS alerts (
-                    id SERIAL PRIMARY KEY,
-                    user_id TEXT,
-                    coin TEXT,
-                    price REAL,
-                    original_price REAL,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id)
-                );
-            """)
-            self.conn.commit()
-
-    def load_data(self):
-        with self.conn.cursor() as cur:
-            cur.execute("SELECT * FROM users")
-            self.users = {row['user_id']: dict(row) for row in cur.fetchall()}
-            cur.execute("SELECT * FROM alerts")
-            self.alerts = {}
-            for row in cur.fetchall():
-                user_id = row['user_id']
-                if user_id not in self.alerts:
-                    self.alerts[user_id] = []
-                self.alerts[user_id].append({
-                    'coin': row['coin'],
-                    'price': row['price'],
-                    'original_price': row['original_price']
-                })
-
-    def save_data(self):
-        self.conn.commit()
+    def open(self, load=True):
+        self.pool = ThreadedConnectionPool(
+            self.min_conn, self.max_conn, self.dsn or os.getenv('DATABASE_URL'), cursor_factory=RealDictCursor
+        )
+        self.executor = ThreadPoolExecutor(max_workers=self.max_conn, thread_name_prefix='storage')
+        self.migrate()
+        if load:
+            self.apply_snapshot(*self.transaction(self.snapshot))
+
+    # اجرای مهاجرت‌های باقی‌مانده، هر کدام در تراکنش جداگانه تا خطای یکی نتیجه قبلی‌ها را برنگرداند
+    def migrate(self):
+        while self.transaction(self.apply_next_migration):
+            pass
+
+    # قفل مشورتی تا پایان تراکنش نگه داشته می‌شود، پس فرایندهای هم‌زمان (bot، alerts، web) منتظر می‌مانند
+    # و پس از آن مهاجرت اجراشده را در schema_migrations می‌بینند
+    @staticmethod
+    def apply_next_migration(cur):
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK,))
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """)
+        cur.execute("SELECT version FROM schema_migrations")
+        applied = {row['version'] for row in cur.fetchall()}
+        for migration in MIGRATIONS:
+            if migration.version not in applied and migration.enabled:
+                logger.info(f"اجرای مهاجرت دیتابیس {migration.version}: {migration.description}")
+                migration.apply(cur)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                    (migration.version, migration.description)
+                )
+                return True
+        return False
+
+    # اجرای یک واحد کار روی یک اتصال از استخر در قالب یک تراکنش (commit یا rollback خودکار)
+    def transaction(self, work):
+        conn = self.pool.getconn()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    return work(cur)
+        finally:
+            self.pool.putconn(conn)
+
+    # op نام عملیات برای متریک‌هاست؛ پیش‌فرض نام متدی است که work در آن تعریف شده
+    async def run(self, work, op=None):
+        op = op or work.__qualname__.split('.<locals>')[0].rsplit('.', 1)[-1]
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self.executor, self.transaction, work)
+        except Exception:
+            DB_ERRORS.inc(op=op)
+            raise
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - start, op=op)
+
+    async def fetchone(self, sql, params=None, op=None):
+        def work(cur):
+            cur.execute(sql, params)
+            return cur.fetchone()
+        return await self.run(work, op or sys._getframe(1).f_code.co_name)
+
+    async def fetchall(self, sql, params=None, op=None):
+        def work(cur):
+            cur.execute(sql, params)
+            return cur.fetchall()
+        return await self.run(work, op or sys._getframe(1).f_code.co_name)
+
+    async def execute(self, sql, params=None, op=None):
+        def work(cur):
+            cur.execute(sql, params)
+            return cur.rowcount
+        return await self.run(work, op or sys._getframe(1).f_code.co_name)
+
+    # بارگذاری کامل با کرسر سمت سرور و سطرهای tuple تا به جای یک دیکشنری برای هر سطر، مستقیم رکورد ساخته شود
+    # فقط آنچه نقش این فرایند لازم دارد خوانده می‌شود (load_users و load_alerts)
+    def snapshot(self, cur):
+        users = {}
+        if self.load_users:
+            with cur.connection.cursor('users_snapshot', cursor_factory=psycopg2.extensions.cursor) as rows:
+                rows.itersize = SNAPSHOT_BATCH_SIZE
+                rows.execute("SELECT user_id, first_name, last_name, lang, daily_report FROM users")
+                users = {sys.intern(row[0]): UserRecord(*row[1:]) for row in rows}
+        return users, self.select_alerts(cur) if self.load_alerts else []
+
+    def select_alerts(self, cur, after_id=0):
+        sql = "SELECT id, user_id, coin, price, original_price FROM alerts WHERE id > %s"
+        params = [after_id]
+        if self.partitions is not None:
+            sql += f" AND {PARTITION_FILTER}"
+            params += [ALERT_PARTITIONS, sorted(self.partitions)]
+        with cur.connection.cursor('alerts_snapshot', cursor_factory=psycopg2.extensions.cursor) as alerts:
+            alerts.itersize = SNAPSHOT_BATCH_SIZE
+            alerts.execute(sql + " ORDER BY id", params)
+            return [AlertRecord(*row) for row in alerts]
+
+    # گروه‌بندی هشدارها بر اساس کاربر، ایندکس تازه و شمارش ارزها؛ با یک میلیون هشدار چند ثانیه طول می‌کشد،
+    # پس resync آن را بیرون از حلقه رویداد اجرا می‌کند و ایندکس فعلی تا جایگزینی به بررسی هشدارها ادامه می‌دهد
+    def index_alerts(self, alerts):
+        by_user = {}
+        for alert in alerts:
+            by_user.setdefault(alert.user_id, []).append(alert)
+        index = type(self.alert_index)()
+        index.rebuild(alerts)
+        return by_user, index, Counter(alert.coin for alert in alerts), max((alert.id for alert in alerts), default=0)
+
+    def apply_snapshot(self, users, alerts, indexed=None):
+        self.users = users
+        self.alerts, self.alert_index, coins, self.last_alert_id = indexed or self.index_alerts(alerts)
+        self.watched.clear()
+        for coin, count in coins.items():
+            self.watched.acquire(coin, count)
+        self.daily_subscribers = 0
+        # گزارش روزانه فقط در فرایندی اجرا می‌شود که همه ارزها را دارد
+        if self.partitions is None:
+            self.track_daily(sum(1 for user in self.users.values() if user.daily_report))
+
+    # ارزهای گزارش روزانه تا وقتی حداقل یک مشترک وجود دارد تحت نظر می‌مانند
+    def track_daily(self, delta):
+        before = self.daily_subscribers
+        self.daily_subscribers = max(before + delta, 0)
+        if before == 0 and self.daily_subscribers > 0:
+            for coin in DAILY_REPORT_COINS:
+                self.watched.acquire(coin)
+        elif before > 0 and self.daily_subscribers == 0:
+            for coin in DAILY_REPORT_COINS:
+                self.watched.release(coin)
+
+    # بارگذاری کامل کاربران و هشدارها (هنگام شروع، تغییر بخش‌ها یا همگام‌سازی دوره‌ای)
+    async def resync(self):
+        users, alerts = await self.run(self.snapshot)
+        self.apply_snapshot(users, alerts, await asyncio.to_thread(self.index_alerts, alerts))
+
+    # افزودن هشدارهایی که فرایندهای دیگر پس از آخرین بارگذاری ثبت کرده‌اند
+    async def sync_new_alerts(self):
+        rows = await self.run(lambda cur: self.select_alerts(cur, self.last_alert_id))
+        for row in rows:
+            if not any(alert.id == row.id for alert in self.alerts.get(row.user_id, [])):
+                self.remember_alert(row)
+        return len(rows)
+
+    # هشدارهای یک کاربر؛ در حالت چندفرایندی از دیتابیس خوانده می‌شود چون کارگرها هشدارهای فعال‌شده را حذف می‌کنند
+    # و فرایندی که هشدارها را بررسی نمی‌کند (load_alerts خاموش) کش و ایندکس هشدارها را پر نمی‌کند
+    async def user_alerts(self, user_id):
+        if not self.shared:
+            return self.alerts.get(user_id, [])
+        rows = await self.fetchall(
+            "SELECT id, user_id, coin, price, original_price FROM alerts WHERE user_id = %s ORDER BY id", (user_id,)
+        )
+        alerts = [AlertRecord(**row) for row in rows]
+        if self.load_alerts:
+            current = {alert.id for alert in alerts}
+            known = {alert.id for alert in self.alerts.get(user_id, [])}
+            for alert_id in known - current:
+                self.forget_alert(user_id, alert_id)
+            for alert in alerts:
+                if alert.id not in known:
+                    self.remember_alert(alert)
+        return alerts
+
+    # کاربر از کش؛ در حالت چندفرایندی از دیتابیس خوانده می‌شود چون کاربر ممکن است در نسخه دیگری ثبت شده
+    # یا زبان و گزارش روزانه‌اش را آن‌جا تغییر داده باشد
+    async def get_user(self, user_id):
+        if not self.shared:
+            return self.users.get(user_id)
+        row = await self.fetchone(
+            "SELECT first_name, last_name, lang, daily_report FROM users WHERE user_id = %s", (user_id,)
+        )
+        return UserRecord(**row) if row else None
+
+    async def upsert_user(self, user_id, first_name, last_name):
+        row = await self.fetchone("""
+            INSERT INTO users (user_id, lang, daily_report, first_name, last_name)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (user_id) DO UPDATE SET first_name = %s, last_name = %s
+            RETURNING first_name, last_name, lang, daily_report
+        """, (user_id, 'en', False, first_name, last_name, first_name, last_name))
+        user = UserRecord(**row)
+        if not self.shared:
+            self.users[user_id] = user
+        return user
+
+    async def user_state(self, user_id):
+        row = await self.fetchone("SELECT state FROM users WHERE user_id = %s", (user_id,))
+        return (row and row['state']) or {}
+
+    async def set_user_state(self, user_id, state):
+        await self.execute("UPDATE users SET state = %s WHERE user_id = %s", (json.dumps(state) if state else None, user_id))
+
+    async def set_lang(self, user_id, lang):
+        await self.execute("UPDATE users SET lang = %s WHERE user_id = %s", (lang, user_id))
+        if user_id in self.users:
+            self.users[user_id].lang = lang
+
+    async def toggle_daily(self, user_id):
+        row = await self.fetchone(
+            "UPDATE users SET daily_report = NOT daily_report WHERE user_id = %s RETURNING daily_report", (user_id,)
+        )
+        new_status = row['daily_report']
+        if user_id in self.users:
+            self.users[user_id].daily_report = new_status
+        self.track_daily(1 if new_status else -1)
+        return new_status
+
+    async def add_alert(self, user_id, coin, price, original_price):
+        return (await self.add_alerts(user_id, [(coin, price, original_price)]))[0]
+
+    # ثبت چند هشدار با یک INSERT؛ alerts لیست (coin, price, original_price) است
+    async def add_alerts(self, user_id, alerts):
+        if not alerts:
+            return []
+        rows = [(user_id, coin, price, original_price) for coin, price, original_price in alerts]
+        def work(cur):
+            return execute_values(cur, """
+                INSERT INTO alerts (user_id, coin, price, original_price)
+                VALUES %s
+                RETURNING id, user_id, coin, price, original_price
+            """, rows, page_size=len(rows), fetch=True)
+        added = [AlertRecord(**row) for row in await self.run(work)]
+        if self.load_alerts:
+            for alert in added:
+                self.remember_alert(alert)
+        return added
+
+    def remember_alert(self, alert):
+        self.alerts.setdefault(alert.user_id, []).append(alert)
+        self.alert_index.add(alert)
+        self.watched.acquire(alert.coin)
+        self.ranges.reset(alert.coin)
+        self.last_alert_id = max(self.last_alert_id, alert.id)
+
+    async def delete_alert(self, user_id, alert_id):
+        deleted = await self.execute("DELETE FROM alerts WHERE id = %s AND user_id = %s", (alert_id, user_id)) > 0
+        self.forget_alert(user_id, alert_id)
+        return deleted
+
+    # حذف چند هشدار کاربر با یک DELETE (بدون alert_ids همه هشدارهای کاربر)؛ شناسه‌های حذف‌شده برگردانده می‌شوند
+    async def delete_alerts(self, user_id, alert_ids=None):
+        if alert_ids is None:
+            rows = await self.fetchall("DELETE FROM alerts WHERE user_id = %s RETURNING id", (user_id,))
+        else:
+            rows = await self.fetchall(
+                "DELETE FROM alerts WHERE user_id = %s AND id = ANY(%s) RETURNING id", (user_id, list(alert_ids))
+            )
+        deleted = [row['id'] for row in rows]
+        self.forget_alerts(user_id, deleted if alert_ids is None else alert_ids)
+        return deleted
+
+    def forget_alert(self, user_id, alert_id):
+        self.forget_alerts(user_id, (alert_id,))
+
+    def forget_alerts(self, user_id, alert_ids):
+        alert_ids = set(alert_ids)
+        alerts = []
+        for alert in self.alerts.get(user_id, []):
+            if alert.id not in alert_ids:
+                alerts.append(alert)
+            else:
+                self.watched.release(alert.coin)
+        if alerts:
+            self.alerts[user_id] = alerts
+        else:
+            self.alerts.pop(user_id, None)
+        for alert_id in alert_ids:
+            self.alert_index.remove(alert_id)
+
+    # هشدارهای فعال‌شده تا پایان ارسال از ایندکس برداشته می‌شوند تا تیک‌های بعدی دوباره فعالشان نکنند
+    def claim_alerts(self, alerts):
+        return [alert for alert in alerts if self.alert_index.remove(alert.id) is not None]
+
+    # بازگرداندن هشداری که ثبتش ناموفق بود، اگر کاربر در این فاصله حذفش نکرده باشد
+    def restore_alert(self, alert):
+        if any(stored.id == alert.id for stored in self.alerts.get(alert.user_id, [])):
+            self.alert_index.add(alert)
+
+    # انتقال هشدارهای فعال‌شده از جدول هشدارها به صف خروجی در یک تراکنش کوتاه
+    # فقط هشدارهایی برداشته می‌شوند که ایندکس همین فرایند برگردانده است؛ هشدارهای تازه فرایندهای دیگر
+    # پس از همگام‌سازی (sync_new_alerts) در تیک‌های بعدی بررسی می‌شوند
+    # هشداری که کاربر هم‌زمان حذف کرده باشد (یا فرایند دیگری برداشته باشد) دیگر حذف نمی‌شود و به صف نمی‌رود
+    async def fire_alerts(self, fired, current_prices):
+        fired = self.claim_alerts(fired)
+        if not fired:
+            return []
+        rows = [(alert.id, alert.coin, current_prices[alert.coin]) for alert in fired]
+        def work(cur):
+            return execute_values(cur, """
+                WITH fired (id, coin, current_price) AS (VALUES %s),
+                claimed AS (
+                    DELETE FROM alerts USING fired
+                    WHERE alerts.id = fired.id AND alerts.coin = fired.coin
+                    RETURNING alerts.id, alerts.user_id, alerts.coin, alerts.price, alerts.original_price, fired.current_price
+                )
+                INSERT INTO alert_outbox (alert_id, user_id, coin, price, original_price, current_price)
+                SELECT * FROM claimed
+                ON CONFLICT (alert_id) DO NOTHING
+                RETURNING alert_id, user_id
+            """, rows, template="(%s::integer, %s, %s::double precision)", fetch=True)
+        try:
+            claimed = await self.run(work)
+        except Exception:
+            for alert in fired:
+                self.restore_alert(alert)
+            raise
+        forgotten = {}
+        for alert in fired:
+            forgotten.setdefault(alert.user_id, set()).add(alert.id)
+        for user_id, alert_ids in forgotten.items():
+            self.forget_alerts(user_id, alert_ids)
+        return [row['alert_id'] for row in claimed]
+
+    # رهبری کارهای زمان‌بندی‌شده مشترک با قفل مشورتی سطح نشست روی اتصالی جدا از استخر؛
+    # قفل تا قطع همین اتصال (یا پایان فرایند) نگه داشته می‌شود و پس از آن فرایند دیگری رهبر می‌شود
+    def lead(self):
+        if self.leader_conn is not None:
+            try:
+                with self.leader_conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                return True
+            except psycopg2.Error as e:
+                logger.warning(f"اتصال رهبر کارهای زمان‌بندی‌شده قطع شد: {e}")
+                self.leader_conn.close()
+                self.leader_conn = None
+        conn = psycopg2.connect(self.dsn or os.getenv('DATABASE_URL'))
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (LEADER_LOCK,))
+            leader = cur.fetchone()[0]
+        if leader:
+            logger.info("این فرایند رهبر کارهای زمان‌بندی‌شده است")
+            self.leader_conn = conn
+        else:
+            conn.close()
+        return leader
+
+    # فرایند تک (نقش all) همیشه رهبر است
+    async def is_leader(self):
+        if not self.shared:
+            return True
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.lead)
+
+    # قفل‌های مشورتی نقش این فرایند تا پایان اجرا روی اتصالی جدا نگه داشته می‌شوند تا نقش‌های ناسازگار هم‌زمان اجرا نشوند؛
+    # locks فهرست (کلید، انحصاری) است و تا wait ثانیه برای آزاد شدن قفل‌ها (مثلاً خروج نسخه قبلی هنگام استقرار) تلاش می‌شود
+    def hold_locks(self, locks, wait):
+        conn = psycopg2.connect(self.dsn or os.getenv('DATABASE_URL'))
+        conn.autocommit = True
+        deadline = time.monotonic() + wait
+        with conn.cursor() as cur:
+            while True:
+                held = []
+                for key, exclusive in locks:
+                    cur.execute(f"SELECT pg_try_advisory_lock{'' if exclusive else '_shared'}(%s)", (key,))
+                    if not cur.fetchone()[0]:
+                        break
+                    held.append((key, exclusive))
+                else:
+                    self.topology_conn = conn
+                    return True
+                for key, exclusive in held:
+                    cur.execute(f"SELECT pg_advisory_unlock{'' if exclusive else '_shared'}(%s)", (key,))
+                if time.monotonic() >= deadline:
+                    conn.close()
+                    return False
+                time.sleep(1)
+
+    # تعداد فرایندهای ارسال‌کننده پیام با یک توکن: کارگرهای هشدار زنده به‌علاوه فرایند رهبر ربات (یا فرایند تک)
+    async def sender_count(self):
+        row = await self.fetchone(
+            "SELECT count(*) AS workers FROM alert_workers WHERE seen >= now() - make_interval(secs => %s)",
+            (PARTITION_LEASE,)
+        )
+        return row['workers'] + 1
+
+    # مشترکان گزارش روزانه به صورت (user_id, lang) از ایندکس جزئی users_daily_report_idx
+    async def report_subscribers(self):
+        def work(cur):
+            with cur.connection.cursor(cursor_factory=psycopg2.extensions.cursor) as rows:
+                rows.execute("SELECT user_id, lang FROM users WHERE daily_report")
+                return rows.fetchall()
+        return await self.run(work)
 
     def close(self):
-        self.conn.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        if self.leader_conn is not None:
+            self.leader_conn.close()
+            self.leader_conn = None
+        if self.topology_conn is not None:
+            self.topology_conn.close()
+            self.topology_conn = None
+        if self.pool is not None:
+            self.pool.closeall()
 
 storage = Storage()
+metrics.gauge('alerts_active', 'Alerts loaded into the evaluation index', read=lambda: len(storage.alert_index.by_id))
 
-# تابع دریافت قیمت ارز از CoinGecko
-def get_crypto_price(coin_id):
-    try:
-        url = f"{COINGECKO_API}/simple/price?ids={coin_id}&vs_currencies=usd&include_24hr_change=true"
-        response = requests.get(url)
+# کلاس رزرو بخش‌های ارزها برای فرایندهای کارگر هشدار (جدول‌های alert_workers و alert_partitions)
+# هر کارگر با تپش دوره‌ای زنده بودنش را اعلام می‌کند و سهم برابری از بخش‌ها (تقسیم بر تعداد کارگرهای زنده) برمی‌دارد؛
+# بخش‌های اضافه آزاد و بخش‌های بی‌صاحب یا منقضی با SKIP LOCKED برداشته می‌شوند تا هر بخش فقط یک صاحب داشته باشد
+class PartitionLeases:
+    def __init__(self, storage, count=ALERT_PARTITIONS, lease=PARTITION_LEASE, resync_interval=PARTITION_RESYNC_INTERVAL,
+                 owner=None):
+        self.storage = storage
+        self.count = count
+        self.lease = lease
+        self.resync_interval = resync_interval
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.owned = set()
+        self.workers = 1  # کارگرهای زنده در آخرین تقسیم بخش‌ها
+        self.valid_until = 0.0
+
+    def rebalance(self, cur):
+        cur.execute("""
+            INSERT INTO alert_workers (owner, seen) VALUES (%s, now())
+            ON CONFLICT (owner) DO UPDATE SET seen = now()
+        """, (self.owner,))
+        cur.execute("DELETE FROM alert_workers WHERE seen < now() - make_interval(secs => %s)", (self.lease,))
+        cur.execute("""
+            INSERT INTO alert_partitions (partition) SELECT generate_series(0, %s - 1)
+            ON CONFLICT (partition) DO NOTHING
+        """, (self.count,))
+        cur.execute("SELECT count(*) AS workers FROM alert_workers")
+        self.workers = cur.fetchone()['workers']
+        share = -(-self.count // max(self.workers, 1))
+        cur.execute("""
+            UPDATE alert_partitions SET lease_until = now() + make_interval(secs => %s)
+            WHERE owner = %s AND partition < %s
+            RETURNING partition
+        """, (self.lease, self.owner, self.count))
+        owned = sorted(row['partition'] for row in cur.fetchall())
+        if len(owned) > share:
+            cur.execute(
+                "UPDATE alert_partitions SET owner = NULL, lease_until = NULL WHERE partition = ANY(%s)", (owned[share:],)
+            )
+            owned = owned[:share]
+        elif len(owned) < share:
+            cur.execute("""
+                UPDATE alert_partitions SET owner = %s, lease_until = now() + make_interval(secs => %s)
+                WHERE partition IN (
+                    SELECT partition FROM alert_partitions
+                    WHERE partition < %s AND (owner IS NULL OR lease_until < now())
+                    ORDER BY partition
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING partition
+            """, (self.owner, self.lease, self.count, share - len(owned)))
+            owned += [row['partition'] for row in cur.fetchall()]
+        return set(owned)
+
+    def release(self, cur):
+        cur.execute("UPDATE alert_partitions SET owner = NULL, lease_until = NULL WHERE owner = %s", (self.owner,))
+        cur.execute("DELETE FROM alert_workers WHERE owner = %s", (self.owner,))
+
+    async def sync(self):
+        started = time.monotonic()
+        try:
+            owned = await self.storage.run(self.rebalance)
+            self.valid_until = started + self.lease
+            send_queue.share(self.workers + 1)  # به‌علاوه فرایند رهبر ربات که گزارش روزانه را می‌فرستد
+        except Exception as e:
+            logger.error(f"خطا در تمدید بخش‌های هشدار: {e}")
+            # بدون تمدید، بخش‌ها پس از پایان رزرو متعلق به کارگر دیگری هستند
+            owned = self.owned if time.monotonic() < self.valid_until else set()
+        changed = owned != self.owned
+        if changed:
+            logger.info(f"بخش‌های این کارگر: {sorted(owned)}")
+            self.owned = owned
+            self.storage.partitions = owned
+        return changed
+
+    async def run(self):
+        last_resync = time.monotonic()
+        while True:
+            try:
+                if await self.sync() or time.monotonic() - last_resync >= self.resync_interval:
+                    await self.storage.resync()
+                    last_resync = time.monotonic()
+                else:
+                    await self.storage.sync_new_alerts()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"خطا در همگام‌سازی هشدارهای بخش‌ها: {e}")
+            await asyncio.sleep(self.lease / 3)
+
+# کلاس تاریخچه قیمت: هر نمونه در کندل دقیقه‌ای ذخیره و به‌صورت دوره‌ای به کندل‌های ۵ دقیقه، ۱ ساعت و ۱ روز خلاصه می‌شود
+class PriceHistory:
+    # resolution -> (منبع خلاصه‌سازی، مدت نگهداری به ثانیه یا None برای همیشه)
+    RESOLUTIONS = {
+        60: (None, 2 * 86400),
+        300: (60, 14 * 86400),
+        3600: (300, 90 * 86400),
+        86400: (3600, None)
+    }
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.last_recorded = {}  # coin -> زمان آخرین ذخیره (monotonic)
+
+    @staticmethod
+    def resolution_for(seconds):
+        for resolution, (_, retention) in PriceHistory.RESOLUTIONS.items():
+            if retention is None or seconds <= retention:
+                return resolution
+
+    async def record(self, prices):
+        # منابع جریانی چند تیک در ثانیه می‌فرستند؛ هر ارز حداکثر یک بار در PRICE_HISTORY_INTERVAL ذخیره می‌شود
+        now = time.monotonic()
+        rows = []
+        for coin, price in prices.items():
+            if price and now - self.last_recorded.get(coin, float('-inf')) >= PRICE_HISTORY_INTERVAL:
+                self.last_recorded[coin] = now
+                rows.append((coin, price, price, price, price))
+        if not rows:
+            return
+        def work(cur):
+            execute_values(cur, """
+                INSERT INTO price_history (coin, resolution, bucket, open, high, low, close)
+                VALUES %s
+                ON CONFLICT (coin, resolution, bucket) DO UPDATE SET
+                    high = GREATEST(price_history.high, EXCLUDED.high),
+                    low = LEAST(price_history.low, EXCLUDED.low),
+                    close = EXCLUDED.close
+            """, rows, template="(%s, 60, date_trunc('minute', now()), %s, %s, %s, %s)")
+        await self.storage.run(work)
+
+    # خلاصه‌سازی کندل‌های اخیر هر سطح از سطح پایین‌تر و حذف داده‌های قدیمی‌تر از مدت نگهداری
+    async def downsample(self):
+        def work(cur):
+            for resolution, (source, retention) in self.RESOLUTIONS.items():
+                if source is not None:
+                    cur.execute("""
+                        INSERT INTO price_history (coin, resolution, bucket, open, high, low, close)
+                        SELECT coin, %(res)s, to_timestamp(floor(extract(epoch FROM bucket) / %(res)s) * %(res)s) AS b,
+                               (array_agg(open ORDER BY bucket))[1], max(high), min(low),
+                               (array_agg(close ORDER BY bucket DESC))[1]
+                        FROM price_history
+                        WHERE resolution = %(src)s
+                          AND bucket >= to_timestamp(floor(extract(epoch FROM now()) / %(res)s) * %(res)s - 2 * %(res)s)
+                        GROUP BY coin, b
+                        ON CONFLICT (coin, resolution, bucket) DO UPDATE SET
+                            open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low, close = EXCLUDED.close
+                    """, {'res': resolution, 'src': source})
+                if retention is not None:
+                    cur.execute(
+                        "DELETE FROM price_history WHERE resolution = %s AND bucket < now() - make_interval(secs => %s)",
+                        (resolution, retention)
+                    )
+        await self.storage.run(work)
+
+    # آمار یک بازه زمانی اخیر: کمینه، بیشینه، اولین و آخرین قیمت و درصد تغییر
+    async def window(self, coin, seconds, resolution=None):
+        resolution = resolution or self.resolution_for(seconds)
+        row = await self.storage.fetchone("""
+            SELECT min(low) AS min, max(high) AS max,
+                   (array_agg(open ORDER BY bucket))[1] AS first,
+                   (array_agg(close ORDER BY bucket DESC))[1] AS last,
+                   count(*) AS points
+            FROM price_history
+            WHERE coin = %s AND resolution = %s AND bucket >= now() - make_interval(secs => %s)
+        """, (coin, resolution, seconds))
+        if not row or not row['points']:
+            return None
+        stats = dict(row)
+        stats['change'] = (stats['last'] - stats['first']) / stats['first'] * 100 if stats['first'] else None
+        return stats
+
+    async def last_points(self, coin, n, resolution=60):
+        rows = await self.storage.fetchall("""
+            SELECT bucket, open, high, low, close FROM price_history
+            WHERE coin = %s AND resolution = %s
+            ORDER BY bucket DESC LIMIT %s
+        """, (coin, resolution, n))
+        return [dict(row) for row in reversed(rows)]
+
+    async def min(self, coin, seconds):
+        stats = await self.window(coin, seconds)
+        return stats and stats['min']
+
+    async def max(self, coin, seconds):
+        stats = await self.window(coin, seconds)
+        return stats and stats['max']
+
+    async def pct_change(self, coin, seconds):
+        stats = await self.window(coin, seconds)
+        return stats and stats['change']
+
+price_history = PriceHistory(storage)
+
+class CircuitOpenError(Exception):
+    pass
+
+# کلاس قطع‌کننده مدار برای سرویس بیرونی
+# پس از چند خطای پیاپی درخواست‌ها تا پایان مهلت بدون ارسال رد می‌شوند، سپس فقط یک درخواست آزمایشی فرستاده می‌شود
+# مهلت با هر قطع دوباره دو برابر می‌شود (با تصادف برای پخش شدن تلاش‌ها) و Retry-After پاسخ 429 رعایت می‌شود
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET, max_timeout=BREAKER_MAX_RESET):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_timeout = max_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0  # تعداد قطع‌های پیاپی بدون موفقیت میان آن‌ها
+        self.retry_at = 0.0
+        self.probing = False
+
+    def allow(self):
+        if self.state == self.OPEN and time.monotonic() >= self.retry_at:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self.probing:
+                return False
+            self.probing = True
+        return self.state != self.OPEN
+
+    def remaining(self):
+        return max(self.retry_at - time.monotonic(), 0.0)
+
+    def release(self):
+        self.probing = False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info(f"ارتباط با {self.name} برقرار شد")
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.probing = False
+
+    def record_failure(self, retry_after=None):
+        self.failures += 1
+        self.probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold or retry_after is not None:
+            self.trip(retry_after)
+
+    def trip(self, retry_after=None):
+        timeout = min(self.reset_timeout * 2 ** self.trips, self.max_timeout)
+        timeout = random.uniform(timeout / 2, timeout)
+        if retry_after is not None:
+            timeout = max(timeout, retry_after)
+        self.trips += 1
+        self.state = self.OPEN
+        self.retry_at = time.monotonic() + timeout
+        logger.warning(f"درخواست‌ها به {self.name} به مدت {timeout:.0f} ثانیه متوقف شد (خطاهای پیاپی: {self.failures})")
+
+# کلاس کلاینت غیرهمزمان CoinGecko با اتصال‌های ماندگار، محدودیت هم‌زمانی و قطع‌کننده مدار
+# درخواست‌ها خودشان تکرار نمی‌شوند؛ تلاش دوباره با دور بعدی انجام می‌شود و قطع‌کننده فاصله آن را تعیین می‌کند
+class CoinGeckoClient:
+    def __init__(self, base_url=COINGECKO_API, timeout=HTTP_TIMEOUT, max_concurrency=HTTP_MAX_CONCURRENCY):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.breaker = CircuitBreaker('CoinGecko')
+        self.client = None
+
+    def session(self):
+        if self.client is None or self.client.is_closed:
+            self.client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+                headers={'Accept': 'application/json'}
+            )
+        return self.client
+
+    @staticmethod
+    def retry_after(response):
+        try:
+            return float(response.headers.get('Retry-After', ''))
+        except ValueError:
+            return None
+
+    async def get_json(self, path, params=None):
+        async with self.semaphore:
+            # وضعیت قطع‌کننده پس از گرفتن نوبت بررسی می‌شود تا درخواست‌های در صف روی سرویس در حال قطع انباشته نشوند
+            if not self.breaker.allow():
+                COINGECKO_REQUESTS.inc(endpoint=path, status='circuit_open')
+                raise CircuitOpenError(f"CoinGecko unavailable, retrying in {self.breaker.remaining():.0f}s")
+            start = time.perf_counter()
+            try:
+                response = await self.session().get(path, params=params)
+            except httpx.TransportError:
+                COINGECKO_REQUESTS.inc(endpoint=path, status='error')
+                self.breaker.record_failure()
+                raise
+            finally:
+                self.breaker.release()
+                COINGECKO_SECONDS.observe(time.perf_counter() - start, endpoint=path)
+        COINGECKO_REQUESTS.inc(endpoint=path, status=response.status_code)
+        if response.status_code == 429:
+            self.breaker.record_failure(self.retry_after(response) or 0.0)
+        elif response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
         response.raise_for_status()
-        data = response.json()
-        price = data[coin_id]['usd']
-        change_24h = data[coin_id]['usd_24h_change']
+        return response.json()
+
+    # تقسیم شناسه‌ها به بخش‌هایی با تعداد و طول محدود تا آدرس درخواست از حد مجاز بیشتر نشود
+    @staticmethod
+    def chunks(coin_ids, size=COINGECKO_BATCH_SIZE, max_length=COINGECKO_MAX_IDS_LENGTH):
+        chunk, length = [], 0
+        for coin in coin_ids:
+            if chunk and (len(chunk) >= size or length + len(coin) + 1 > max_length):
+                yield chunk
+                chunk, length = [], 0
+            chunk.append(coin)
+            length += len(coin) + 1
+        if chunk:
+            yield chunk
+
+    async def simple_price_chunk(self, coin_ids):
+        return await self.get_json('/simple/price', {
+            'ids': ','.join(coin_ids),
+            'vs_currencies': 'usd',
+            'include_24hr_change': 'true'
+        })
+
+    # دریافت هم‌زمان همه بخش‌ها (با سقف هم‌زمانی کلاینت) و ادغام نتایج؛ شکست یک بخش بقیه را از بین نمی‌برد
+    async def simple_price(self, coin_ids):
+        chunks = list(self.chunks(coin_ids))
+        results = await asyncio.gather(*(self.simple_price_chunk(chunk) for chunk in chunks), return_exceptions=True)
+        data = {}
+        errors = []
+        for chunk, result in zip(chunks, results):
+            if isinstance(result, Exception):
+                if not isinstance(result, CircuitOpenError):
+                    logger.warning(f"خطا در دریافت قیمت {len(chunk)} ارز: {result}")
+                errors.append(result)
+            else:
+                data.update(result)
+        if errors and not data:
+            raise errors[0]
+        return data
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+coingecko = CoinGeckoClient()
+
+# کلاس کش قیمت‌ها با زمان انقضا برای هر ارز و ادغام درخواست‌های هم‌زمان
+# اگر دریافت ناموفق باشد، آخرین قیمت معتبر (تا stale_max_age) با کلید stale (عمر به ثانیه) برگردانده می‌شود
+class PriceCache:
+    def __init__(self, fetcher, ttl=PRICE_CACHE_TTL, stale_max_age=PRICE_STALE_MAX_AGE, ranges=None):
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.stale_max_age = stale_max_age
+        self.ranges = ranges  # همه قیمت‌های تازه برای بررسی بازه‌ای هشدارها ثبت می‌شوند
+        self.entries = {}  # coin -> (timestamp, {'usd': ..., 'usd_24h_change': ...})
+        self.inflight = {}  # coin -> future درخواست در حال اجرا
+
+    async def get_many(self, coin_ids, max_age=None, stale=True):
+        max_age = self.ttl if max_age is None else max_age
+        now = time.monotonic()
+        result = {}
+        missing = []
+        waiting = {}
+        failure = None
+        for coin in coin_ids:
+            entry = self.entries.get(coin)
+            if entry and now - entry[0] < max_age:
+                result[coin] = entry[1]
+            elif coin in self.inflight:
+                waiting[coin] = self.inflight[coin]
+            else:
+                missing.append(coin)
+
+        if missing:
+            future = asyncio.get_running_loop().create_future()
+            for coin in missing:
+                self.inflight[coin] = future
+            try:
+                data = await self.fetcher(missing)
+                stamp = time.monotonic()
+                if self.ranges is not None:
+                    self.ranges.observe_all(data)
+                for coin in missing:
+                    if coin in data:
+                        self.entries[coin] = (stamp, data[coin])
+                        result[coin] = data[coin]
+                future.set_result(data)
+            except Exception as e:
+                future.set_exception(e)
+                future.exception()  # جلوگیری از هشدار استثنای بازیابی‌نشده
+                failure = e
+            finally:
+                # اگر درخواست آغازکننده لغو شود (پایان مهلت پاسخ یا خاموش شدن)، منتظران دیگر با خطا آزاد می‌شوند نه با لغو
+                if not future.done():
+                    future.set_exception(RuntimeError("price fetch was cancelled"))
+                    future.exception()
+                for coin in missing:
+                    if self.inflight.get(coin) is future:
+                        del self.inflight[coin]
+
+        for coin, pending in waiting.items():
+            try:
+                data = await pending
+            except Exception as e:
+                failure = e
+                continue
+            if coin in data:
+                result[coin] = data[coin]
+
+        if stale:
+            for coin in coin_ids:
+                entry = self.entries.get(coin)
+                if coin not in result and entry and now - entry[0] < self.stale_max_age:
+                    result[coin] = dict(entry[1], stale=now - entry[0])
+        if failure is not None and not result:
+            raise failure
+        return result
+
+    async def get(self, coin_id, max_age=None, stale=True):
+        return (await self.get_many([coin_id], max_age, stale)).get(coin_id)
+
+    # ثبت قیمت‌هایی که منابع جریانی فرستاده‌اند تا منوها هم همان قیمت را نشان دهند
+    def put(self, data):
+        stamp = time.monotonic()
+        for coin, prices in data.items():
+            self.entries[coin] = (stamp, prices)
+        if self.ranges is not None:
+            self.ranges.observe_all(data)
+
+price_cache = PriceCache(coingecko.simple_price, ranges=storage.ranges)
+
+# تابع دریافت قیمت ارز (از طریق کش)؛ مقدار سوم عمر قیمت به ثانیه است اگر آخرین قیمت معتبر برگردانده شده باشد
+async def get_crypto_price(coin_id):
+    try:
+        data = await price_cache.get(coin_id)
+        price = data['usd']
+        change_24h = data['usd_24h_change']
         logger.info(f"دریافت قیمت برای {coin_id}: ${price}")
-        return price, change_24h
+        return price, change_24h, data.get('stale')
     except Exception as e:
         logger.error(f"خطا در دریافت قیمت برای {coin_id}: {e}")
-        return None, None
+        return None, None, None
+
+def stale_notice(age, lang):
+    return LANGUAGES[lang]['stale_price'].format(minutes=max(int(age // 60), 1))
+
+# کلاس سطل توکن برای محدود کردن نرخ کلی ارسال پیام
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+# پیام در انتظار ارسال؛ attempt شماره تلاش و reserved یعنی نوبت چت پیش‌تر برای این پیام رزرو شده است
+OutgoingMessage = namedtuple('OutgoingMessage', 'bot chat_id text kwargs future attempt reserved')
+
+# کلاس صف ارسال پیام‌های تلگرام با چند کارگر هم‌زمان، محدودیت نرخ کلی و هر چت، و رعایت retry_after
+# کارگرها منتظر نوبت یک چت یا تلاش دوباره نمی‌مانند: این پیام‌ها کنار گذاشته و سر وقت دوباره به صف برمی‌گردند
+# تا چند پیام پشت سر هم به یک چت ارسال به بقیه چت‌ها را معطل نکند
+class SendQueue:
+    def __init__(self, workers=SEND_WORKERS, rate=SEND_RATE, per_chat_interval=SEND_PER_CHAT_INTERVAL,
+                 max_attempts=SEND_MAX_ATTEMPTS):
+        self.num_workers = workers
+        self.rate = rate
+        self.bucket = TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self.max_attempts = max_attempts
+        self.queue = None
+        self.workers = []
+        self.chat_ready = {}  # chat_id -> زمان مجاز بعدی برای ارسال به آن چت
+        self.parked = {}  # chat_id -> پیام‌های منتظر نوبت آن چت به ترتیب ارسال
+        self.paused_until = 0.0  # توقف کلی بعد از خطای flood تلگرام
+        self.stats = Counter()
+
+    # سقف نرخ تلگرام برای کل توکن است، پس نرخ بین فرایندهای ارسال‌کننده تقسیم می‌شود
+    def share(self, senders):
+        rate = self.rate / max(senders, 1)
+        if rate != self.bucket.rate:
+            logger.info(f"نرخ ارسال این فرایند: {rate:.1f} پیام در ثانیه ({senders} فرایند ارسال‌کننده)")
+            self.bucket.rate = self.bucket.capacity = rate
+            self.bucket.tokens = min(self.bucket.tokens, rate)
+
+    def submit(self, bot, chat_id, text, **kwargs):
+        if not self.workers:
+            self.queue = asyncio.Queue()
+            self.workers = [asyncio.create_task(self.worker()) for _ in range(self.num_workers)]
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait(OutgoingMessage(bot, chat_id, text, kwargs, future, 0, False))
+        return future
+
+    async def send(self, bot, chat_id, text, **kwargs):
+        return await self.submit(bot, chat_id, text, **kwargs)
+
+    async def worker(self):
+        while True:
+            message = await self.queue.get()
+            try:
+                if not message.reserved and self.park(message):
+                    continue  # پیام با نوبت چت دوباره به صف برمی‌گردد و task_done آن‌جا زده می‌شود
+                result = await self.deliver(message)
+            except Exception as e:
+                logger.error(f"خطای پیش‌بینی‌نشده در ارسال پیام به {message.chat_id}: {e}")
+                result = 'error'
+            if result is None:
+                continue  # تلاش دوباره زمان‌بندی شده است
+            self.queue.task_done()
+            self.stats[result] += 1
+            TELEGRAM_MESSAGES.inc(result=result)
+            if not message.future.done():
+                message.future.set_result(result)
+
+    # بازگرداندن پیام کنارگذاشته به صف؛ task_done نوبت قبلی را می‌بندد تا queue.join تا نتیجه نهایی پیام منتظر بماند
+    def requeue(self, message):
+        self.queue.put_nowait(message)
+        self.queue.task_done()
+
+    # رزرو نوبت چت برای پیام؛ اگر چت هنوز مجاز نیست یا پیام‌های قبلی‌اش منتظرند، پیام در صف همان چت کنار گذاشته می‌شود
+    def park(self, message):
+        now = time.monotonic()
+        waiting = self.parked.get(message.chat_id)
+        if waiting is not None:
+            waiting.append(message)
+            return True
+        ready = self.chat_ready.get(message.chat_id, 0.0)
+        if ready > now:
+            self.parked[message.chat_id] = deque([message])
+            asyncio.get_running_loop().call_later(ready - now, self.unpark, message.chat_id)
+            return True
+        self.chat_ready[message.chat_id] = now + self.per_chat_interval
+        if len(self.chat_ready) > 10000:
+            self.chat_ready = {chat: t for chat, t in self.chat_ready.items() if t > now or chat in self.parked}
+        return False
 
-# تابع چک کردن هشدارها
-async def check_alerts(context: ContextTypes.DEFAULT_TYPE):
+    # هر بار یک پیام از صف چت با نوبت رزروشده به صف اصلی برمی‌گردد و پیام بعدی برای نوبت بعد زمان‌بندی می‌شود
+    def unpark(self, chat_id):
+        waiting = self.parked[chat_id]
+        message = waiting.popleft()
+        self.chat_ready[chat_id] = time.monotonic() + self.per_chat_interval
+        if waiting:
+            asyncio.get_running_loop().call_later(self.per_chat_interval, self.unpark, chat_id)
+        else:
+            del self.parked[chat_id]
+        self.requeue(message._replace(reserved=True))
+
+    # یک تلاش ارسال؛ نتیجه: 'sent' ارسال موفق، 'failed' خطای دائمی (مثلاً کاربر ربات را بلاک کرده)،
+    # 'error' شکست پس از تلاش‌های مکرر، یا None اگر تلاش دوباره زمان‌بندی شده باشد
+    async def deliver(self, message):
+        pause = self.paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        await self.bucket.acquire()
+        try:
+            with TELEGRAM_SEND_SECONDS.time():
+                await message.bot.send_message(chat_id=message.chat_id, text=message.text, **message.kwargs)
+            return 'sent'
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else float(e.retry_after)
+            logger.warning(f"محدودیت ارسال تلگرام، توقف به مدت {retry_after} ثانیه")
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            self.stats['retry_after'] += 1
+            delay = 0
+        except (Forbidden, BadRequest) as e:
+            logger.warning(f"ارسال پیام به {message.chat_id} ناموفق بود: {e}")
+            return 'failed'
+        except (TimedOut, NetworkError) as e:
+            logger.warning(f"خطای شبکه در ارسال پیام به {message.chat_id} (تلاش {message.attempt + 1}): {e}")
+            delay = min(2 ** message.attempt, 30) + random.random()
+        if message.attempt + 1 >= self.max_attempts:
+            return 'error'
+        retry = message._replace(attempt=message.attempt + 1, reserved=False)
+        asyncio.get_running_loop().call_later(delay, self.requeue, retry)
+        return None
+
+    async def close(self):
+        for task in self.workers:
+            task.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+send_queue = SendQueue()
+metrics.gauge('telegram_send_queue_depth', 'Messages waiting in the send queue',
+              read=lambda: send_queue.queue.qsize() if send_queue.queue is not None else 0)
+
+# کارهای پس‌زمینه تا پایان اجرا نگه داشته می‌شوند (asyncio فقط ارجاع ضعیف نگه می‌دارد)
+background_tasks = set()
+
+def spawn(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# کلاس صف خروجی هشدارها (جدول alert_outbox)
+# کارگرها هر بار دسته‌ای از هشدارها را با FOR UPDATE SKIP LOCKED برای مدت OUTBOX_LEASE رزرو می‌کنند،
+# ارسال می‌کنند و سپس حذف می‌کنند؛ تا وقتی پیامی در صف ارسال منتظر است رزروش تمدید می‌شود
+# و فقط اگر فرایند وسط کار از کار بیفتد، پس از پایان رزرو هشدار دوباره ارسال می‌شود
+class AlertOutbox:
+    def __init__(self, storage, num_workers=OUTBOX_WORKERS, batch_size=OUTBOX_BATCH_SIZE, lease=OUTBOX_LEASE,
+                 poll_interval=OUTBOX_POLL_INTERVAL, max_attempts=OUTBOX_MAX_ATTEMPTS):
+        self.storage = storage
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.wakeup = None
+        self.workers = []
+        self.stats = Counter()
+
+    def start(self, bot):
+        if not self.workers:
+            self.wakeup = asyncio.Event()
+            self.workers = [spawn(self.worker(bot)) for _ in range(self.num_workers)]
+
+    def wake(self):
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    # زبان کاربر همراه هشدار خوانده می‌شود تا کارگرهای فرایندهای دیگر هم بتوانند پیام را بسازند
+    async def claim(self):
+        return await self.storage.fetchall("""
+            UPDATE alert_outbox SET lease_until = now() + make_interval(secs => %s), attempts = attempts + 1
+            FROM users
+            WHERE users.user_id = alert_outbox.user_id AND alert_outbox.id IN (
+                SELECT id FROM alert_outbox
+                WHERE lease_until IS NULL OR lease_until < now()
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING alert_outbox.*, users.lang
+        """, (self.lease, self.batch_size))
+
+    # تمدید رزرو هشدارهایی که هنوز در صف ارسال منتظرند (مثلاً پشت پیام‌های گزارش روزانه)
+    # تا پایان رزرو در میانه انتظار باعث برداشتن دوباره و ارسال تکراری در کارگر دیگری نشود
+    async def renew(self, rows, futures):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            pending = [row['id'] for row, future in zip(rows, futures) if not future.done()]
+            if not pending:
+                return
+            try:
+                await self.storage.execute(
+                    "UPDATE alert_outbox SET lease_until = now() + make_interval(secs => %s) WHERE id = ANY(%s)",
+                    (self.lease, pending)
+                )
+            except Exception as e:
+                logger.error(f"خطا در تمدید رزرو هشدارهای صف خروجی: {e}")
+
+    # حذف پیام‌های تمام‌شده و زمان‌بندی دوباره خطاهای موقت با فاصله نمایی
+    async def finish(self, done, retry):
+        def work(cur):
+            if done:
+                cur.execute("DELETE FROM alert_outbox WHERE id = ANY(%s)", (done,))
+            if retry:
+                cur.execute("""
+                    UPDATE alert_outbox SET lease_until = now() + make_interval(secs => least(power(2, attempts), 300))
+                    WHERE id = ANY(%s)
+                """, (retry,))
+        await self.storage.run(work)
+
+    def render(self, row):
+        lang = row['lang'] if row['lang'] in LANGUAGES else 'en'
+        return LANGUAGES[lang]['alert_triggered'].format(
+            coin=coin_universe.name(row['coin'], lang),
+            price=row['price'],
+            current=row['current_price']
+        )
+
+    async def drain(self, bot):
+        rows = await self.claim()
+        if not rows:
+            return 0
+        futures = [send_queue.submit(bot, row['user_id'], self.render(row)) for row in rows]
+        renewal = spawn(self.renew(rows, futures))
+        try:
+            results = await asyncio.gather(*futures)
+        finally:
+            renewal.cancel()
+        done, retry = [], []
+        for row, result in zip(rows, results):
+            if result != 'error':
+                done.append(row['id'])
+            elif row['attempts'] >= self.max_attempts:
+                logger.warning(f"هشدار {row['alert_id']} پس از {row['attempts']} تلاش کنار گذاشته شد")
+                done.append(row['id'])
+            else:
+                retry.append(row['id'])
+        await self.finish(done, retry)
+        self.stats.update(results)
+        logger.info(f"نتیجه ارسال هشدارها: {dict(Counter(results))}")
+        return len(rows)
+
+    async def worker(self, bot):
+        while True:
+            try:
+                processed = await self.drain(bot)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"خطا در پردازش صف هشدارها: {e}")
+                processed = 0
+            if not processed:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+
+alert_outbox = AlertOutbox(storage)
+
+# کلاس پایه منابع قیمت
+# هر منبع یک جریان غیرهمزمان از دسته‌های قیمت {coin: {'usd': ..., 'usd_24h_change': ...}} تولید می‌کند
+class PriceSource:
+    name = 'base'
+    polling = False  # منابع درخواستی زمان‌بندی دریافت هر ارز را از فاصله تا هدف می‌گیرند
+
+    def __init__(self, watched, cache=None):
+        self.watched = watched
+        self.cache = cache
+
+    async def ticks(self):
+        raise NotImplementedError
+        yield
+
+# منبع درخواستی CoinGecko: فقط ارزهای تحت نظری که نوبت دریافتشان رسیده دریافت می‌شوند
+class CoinGeckoPoller(PriceSource):
+    name = 'coingecko'
+    polling = True
+
+    # skip ارزهایی را کنار می‌گذارد که منبع دیگری (جریان بایننس) قیمتشان را می‌رساند
+    def __init__(self, watched, cache=None, interval=POLL_FAST_INTERVAL, skip=None):
+        super().__init__(watched, cache or price_cache)
+        self.interval = interval
+        self.skip = skip
+
+    async def ticks(self):
+        while True:
+            due = self.watched.due(time.monotonic())
+            if self.skip is not None:
+                due = [coin for coin in due if not self.skip(coin)]
+            if due:
+                try:
+                    # قیمت‌ها برای هر دور تازه گرفته می‌شوند و کش را برای بقیه کاربران هم به‌روز می‌کنند
+                    data = await self.cache.get_many(due, max_age=self.interval / 2, stale=False)
+                except CircuitOpenError:
+                    data = {}  # قطع‌کننده هنگام قطع شدن لاگ کرده است
+                except Exception as e:
+                    logger.error(f"خطا در دریافت قیمت‌ها در چک کردن هشدارها: {e}")
+                    data = {}
+                if data:
+                    yield data
+            await asyncio.sleep(self.interval)
+
+# منبع جریانی صرافی بایننس (miniTicker همه بازارها، حدود یک پیام در ثانیه)
+# قیمت جفت‌های USDT به‌جای دلار استفاده می‌شود و فقط ارزهای تحت نظر نگه داشته می‌شوند؛
+# ارزی که جفتش در BINANCE_PAIRS نیست یا مدتی در جریان نیامده پوشش داده نمی‌شود (covers) و از CoinGecko دریافت می‌شود
+class BinanceTickerSource(PriceSource):
+    name = 'binance'
+
+    def __init__(self, watched, cache=None, url=BINANCE_WS_URL, pairs=BINANCE_PAIRS, stale_after=BINANCE_STALE_SECONDS):
+        super().__init__(watched, cache or price_cache)
+        self.url = url
+        self.coins = {pair: coin for coin, pair in pairs.items()}  # جفت بازار -> شناسه ارز
+        self.stale_after = stale_after
+        self.seen = {}  # coin -> زمان آخرین تیک (monotonic)
+
+    def covers(self, coin):
+        seen = self.seen.get(coin)
+        return seen is not None and time.monotonic() - seen < self.stale_after
+
+    def parse(self, payload):
+        now = time.monotonic()
+        data = {}
+        for ticker in payload if isinstance(payload, list) else [payload]:
+            coin = self.coins.get(ticker.get('s'))
+            if coin is None:
+                continue
+            self.seen[coin] = now
+            if coin not in self.watched:
+                continue
+            price = float(ticker['c'])
+            open_price = float(ticker['o'])
+            data[coin] = {
+                'usd': price,
+                'usd_24h_change': (price - open_price) / open_price * 100 if open_price else 0.0
+            }
+        return data
+
+    async def ticks(self):
+        delay = 1
+        while True:
+            try:
+                async with websockets.connect(self.url, ping_interval=20) as connection:
+                    delay = 1
+                    async for message in connection:
+                        data = self.parse(json.loads(message))
+                        if data:
+                            self.cache.put(data)
+                            yield data
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"اتصال جریان قیمت قطع شد: {e}؛ اتصال دوباره پس از {delay} ثانیه")
+            await asyncio.sleep(delay + random.uniform(0, 1))
+            delay = min(delay * 2, 60)
+
+# منبع شبیه‌سازی‌شده برای آزمایش و بنچمارک بدون شبکه
+# با path تیک‌های ضبط‌شده (هر خط {"ts": ..., "prices": {coin: price یا [open, high, low, close]}}) با سرعت speed پخش می‌شوند،
+# وگرنه برای ارزهای تحت نظر (یا coins) گام تصادفی با نوسان volatility هر interval ثانیه ساخته می‌شود
+# speed یا interval صفر یعنی پخش با بیشترین سرعت
+class SimulatedFeed(PriceSource):
+    name = 'simulated'
+
+    def __init__(self, watched, cache=None, coins=None, path=None, interval=SIMULATED_FEED_INTERVAL,
+                 volatility=SIMULATED_FEED_VOLATILITY, speed=1.0, seed=None, limit=None):
+        super().__init__(watched, cache)
+        self.coins = coins
+        self.path = path
+        self.interval = interval
+        self.volatility = volatility
+        self.speed = speed
+        self.limit = limit
+        self.random = random.Random(seed)
+        self.prices = {}
+        self.opens = {}
+
+    @staticmethod
+    def load(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record['ts'], record['prices']
+
+    def start_price(self, coin):
+        entry = self.cache.entries.get(coin) if self.cache is not None else None
+        return entry[1]['usd'] if entry else 100.0
+
+    def step(self, prices):
+        data = {}
+        for coin, price in prices.items():
+            # تیک ضبط‌شده می‌تواند به جای قیمت، کندل [open, high, low, close] بازه باشد
+            candle = price if isinstance(price, (list, tuple)) else None
+            if candle is not None:
+                price = candle[3]
+            self.prices[coin] = price
+            open_price = self.opens.setdefault(coin, candle[0] if candle is not None else price)
+            data[coin] = {'usd': price, 'usd_24h_change': (price / open_price - 1) * 100}
+            if candle is not None:
+                data[coin].update(usd_high=candle[1], usd_low=candle[2])
+        if self.cache is not None:
+            self.cache.put(data)
+        return data
+
+    async def replay(self):
+        previous = None
+        for ts, prices in self.load(self.path):
+            if previous is not None and self.speed:
+                await asyncio.sleep(max(ts - previous, 0) / self.speed)
+            else:
+                await asyncio.sleep(0)
+            previous = ts
+            yield self.step(prices)
+
+    async def synthetic(self):
+        while True:
+            prices = {}
+            for coin in self.coins if self.coins is not None else list(self.watched.refs):
+                price = self.prices.get(coin) or self.start_price(coin)
+                prices[coin] = price * (1 + self.random.gauss(0, self.volatility))
+            if prices:
+                yield self.step(prices)
+            await asyncio.sleep(self.interval)
+
+    async def ticks(self):
+        count = 0
+        async for data in self.replay() if self.path else self.synthetic():
+            yield data
+            count += 1
+            if self.limit is not None and count >= self.limit:
+                return
+
+# منابع قیمتی که هم‌زمان اجرا می‌شوند؛ کنار جریان بایننس، ارزهایی که جریان پوشش نمی‌دهد از CoinGecko دریافت می‌شوند
+def make_price_sources():
+    if PRICE_SOURCE == 'binance':
+        if websockets is not None:
+            stream = BinanceTickerSource(storage.watched)
+            return [stream, CoinGeckoPoller(storage.watched, skip=stream.covers)]
+        logger.warning("کتابخانه websockets نصب نیست؛ قیمت‌ها از CoinGecko دریافت می‌شوند")
+    elif PRICE_SOURCE == 'simulated':
+        return [SimulatedFeed(storage.watched, price_cache, path=SIMULATED_FEED_PATH or None)]
+    return [CoinGeckoPoller(storage.watched)]
+
+# تابع بررسی یک دسته قیمت تازه: هشدارهای فعال‌شده بلافاصله به صف خروجی منتقل و کارگرهای ارسال بیدار می‌شوند
+async def check_alerts(bot, data, reschedule=True):
+    now = time.monotonic()
+    start = time.perf_counter()
+    current_prices = {coin: prices['usd'] for coin, prices in data.items()}
+    highs, lows = storage.ranges.take(data)
+    ALERT_COINS_EVALUATED.inc(len(current_prices))
+    ALERTS_EVALUATED.inc(storage.alert_index.count(current_prices))
+    fired = storage.alert_index.triggered(highs, lows)
+    if fired:
+        try:
+            ALERTS_FIRED.inc(len(await storage.fire_alerts(fired, current_prices)))
+            alert_outbox.wake()
+        except Exception as e:
+            logger.error(f"خطا در ثبت هشدارهای فعال‌شده: {e}")
+    if reschedule:
+        storage.watched.reschedule(current_prices, storage.alert_index.distances(current_prices), now)
+    ALERT_TICK_SECONDS.observe(time.perf_counter() - start)
     try:
-        ids = ','.join(CURRENCIES.keys())
-        url = f"{COINGECKO_API}/simple/price?ids={ids}&vs_currencies=usd&include_24hr_change=true"
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        current_prices = {coin: data[coin]['usd'] for coin in CURRENCIES if coin in data}
+        await price_history.record(current_prices)
     except Exception as e:
-        logger.error(f"خطا در دریافت قیمت‌ها در چک کردن هشدارها: {e}")
-        return
+        logger.error(f"خطا در ذخیره تاریخچه قیمت‌ها: {e}")
 
-    with storage.conn.cursor() as cur:
-        cur.execute("SELECT * FROM alerts")
-        alerts = cur.fetchall()
-        for alert in alerts:
-            user_id = alert['user_id']
-            coin = alert['coin']
-            target_price = alert['price']
-            original_price = alert['original_price']
-            current_price = current_prices.get(coin)
-            lang = storage.users.get(user_id, {}).get('lang', 'en')
-            if current_price and (
-                (target_price > original_price and current_price >= target_price) or
-                (target_price < original_price and current_price <= target_price)
-            ):
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=LANGUAGES[lang]['alert_triggered'].format(
-                        coin=CURRENCIES[coin] if lang == 'fa' else coin.capitalize(),
-                        price=target_price,
-                        current=current_price
-                    )
-                )
-                cur.execute("DELETE FROM alerts WHERE id = %s", (alert['id'],))
-        storage.save_data()
-    storage.load_data()
+# تابع مصرف جریان قیمت منبع انتخاب‌شده تا پایان اجرای ربات
+async def run_price_feed(bot, source):
+    logger.info(f"منبع قیمت: {source.name}")
+    while True:
+        try:
+            async for data in source.ticks():
+                await check_alerts(bot, data, reschedule=source.polling)
+            logger.info(f"جریان قیمت {source.name} به پایان رسید")
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"خطا در جریان قیمت {source.name}: {e}")
+            await asyncio.sleep(POLL_FAST_INTERVAL)
+
+# تابع گروه‌بندی کاربران بر اساس نسخه خروجی (کلید variant) و ارسال متن هر نسخه فقط با یک بار ساخت
+def fan_out(bot, users, variant, render):
+    groups = {}
+    for user_id, user_data in users:
+        groups.setdefault(variant(user_data), []).append(user_id)
+    deliveries = []
+    for key, user_ids in groups.items():
+        text = render(key)
+        deliveries.extend(send_queue.submit(bot, user_id, text) for user_id in user_ids)
+    return deliveries
+
+# تابع ساخت متن گزارش روزانه برای یک زبان
+def render_daily_report(prices, lang, stale=None):
+    report = [LANGUAGES[lang]['daily_report_text']]
+    for coin, price in prices.items():
+        coin_name = coin_universe.name(coin, lang)
+        report.append(f"{coin_name}: ${price}")
+    if stale is not None:
+        report.append(stale_notice(stale, lang))
+    return "\n".join(report)
 
 # تابع ارسال گزارش روزانه
 async def daily_report(context: ContextTypes.DEFAULT_TYPE):
     try:
-        ids = ','.join(CURRENCIES.keys())
-        url = f"{COINGECKO_API}/simple/price?ids={ids}&vs_currencies=usd&include_24hr_change=true"
-        response = requests.get(url)
-        data = response.json()
-        prices = {coin: data[coin]['usd'] for coin in CURRENCIES if coin in data}
+        subscribers = await storage.report_subscribers()
+        send_queue.share(await storage.sender_count())
+    except Exception as e:
+        logger.error(f"خطا در خواندن مشترکان گزارش روزانه: {e}")
+        return
+    if not subscribers:
+        return
+    try:
+        data = await price_cache.get_many(DAILY_REPORT_COINS)
+        prices = {coin: data[coin]['usd'] for coin in DAILY_REPORT_COINS if coin in data}
+        stale = max((data[coin]['stale'] for coin in prices if 'stale' in data[coin]), default=None)
     except Exception as e:
         logger.error(f"خطا در دریافت قیمت‌ها برای گزارش روزانه: {e}")
         return
 
-    for user_id, user_data in storage.users.items():
-        if user_data.get('daily_report', False):
-            lang = user_data.get('lang', 'en')
-            report = [LANGUAGES[lang]['daily_report_text']]
-            for coin, price in list(prices.items())[:10]:
-                coin_name = CURRENCIES[coin] if lang == 'fa' else coin.capitalize()
-                report.append(f"{coin_name}: ${price}")
-            await context.bot.send_message(chat_id=user_id, text="\n".join(report))
+    deliveries = fan_out(
+        context.bot,
+        subscribers,
+        variant=lambda lang: lang if lang in LANGUAGES else 'en',
+        render=lambda lang: render_daily_report(prices, lang, stale)
+    )
+    results = await asyncio.gather(*deliveries)
+    logger.info(f"نتیجه ارسال گزارش روزانه: {dict(Counter(results))}")
 
-# تابع شروع ربات
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    first_name = update.effective_user.first_name or "Unknown"
-    last_name = update.effective_user.last_name or "Unknown"
-    
-    with storage.conn.cursor() as cur:
+# نرمال‌سازی متن جستجو: حروف کوچک، یکسان‌سازی حروف عربی و فارسی، ارقام فارسی، حذف نیم‌فاصله (ZWNJ) و اعراب
+SEARCH_TRANSLATION = str.maketrans({
+    'ي': 'ی', 'ى': 'ی', 'ك': 'ک', 'ة': 'ه', 'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ؤ': 'و',
+    '‌': '', '‏': '', '‎': '', 'ـ': '',
+    **{chr(0x06F0 + i): str(i) for i in range(10)},
+    **{chr(0x0660 + i): str(i) for i in range(10)},
+    **{chr(c): '' for c in range(0x064B, 0x0653)}
+})
+
+def normalize_search(text):
+    return text.lower().translate(SEARCH_TRANSLATION).strip()
+
+def search_tokens(text):
+    return [token for token in re.split(r'[^\w]+', normalize_search(text)) if token]
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+# کلاس ایندکس جستجوی ارز: یک بار ساخته می‌شود و تطبیق دقیق، پیشوندی و سه‌حرفی (trigram) با رتبه‌بندی دارد
+class SearchIndex:
+    def __init__(self, entries):
+        self.coins = []
+        self.terms = {}  # هر نام کامل نرمال‌شده -> شماره محبوب‌ترین ارز با آن نام
+        entries_keys = []
+        for coin_id, terms in entries:
+            pos = len(self.coins)
+            self.coins.append(coin_id)
+            keys = set()
+            for term in (coin_id, *terms):
+                tokens = search_tokens(term)
+                keys.update(tokens)
+                if tokens:
+                    self.terms.setdefault(''.join(tokens), pos)
+                if len(tokens) > 1:
+                    keys.add(''.join(tokens))
+            entries_keys.extend((key, pos) for key in keys)
+        entries_keys.sort()
+        # کلیدهای نرمال‌شده مرتب برای تطبیق دقیق و پیشوندی با bisect، و شماره ارز هر کلید در آرایه موازی
+        self.keys = [key for key, _ in entries_keys]
+        self.key_coins = array('I', (pos for _, pos in entries_keys))
+        grams = {}
+        self.gram_counts = array('H')
+        for key_pos, key in enumerate(self.keys):
+            key_grams = trigrams(key)
+            for gram in key_grams:
+                grams.setdefault(gram, []).append(key_pos)
+            self.gram_counts.append(min(len(key_grams), 65535))
+        # لیست‌های شماره کلید به آرایه فشرده تبدیل می‌شوند تا حافظه در فهرست‌های بزرگ کم بماند
+        self.grams = {gram: array('I', positions) for gram, positions in grams.items()}  # trigram -> شماره کلیدها
+
+    def match_prefix(self, key, scores):
+        i = bisect.bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i].startswith(key):
+            indexed, pos = self.keys[i], self.key_coins[i]
+            score = 3.0 if indexed == key else 2.0 + len(key) / len(indexed)
+            scores[pos] = max(scores.get(pos, 0), score)
+            i += 1
+
+    # ارزی که یکی از نام‌های کاملش (شناسه، نام، نماد یا نام فارسی) با کل متن یکی است
+    def exact(self, query):
+        pos = self.terms.get(''.join(search_tokens(query)))
+        return self.coins[pos] if pos is not None else None
+
+    def search(self, query, limit=5):
+        tokens = search_tokens(query)
+        if not tokens:
+            return []
+        joined = ''.join(tokens)
+        scores = {}
+        self.match_prefix(joined, scores)
+        if not scores and len(tokens) > 1:
+            for token in tokens:
+                self.match_prefix(token, scores)
+        if not scores:  # تطبیق تقریبی فقط وقتی تطبیق دقیق یا پیشوندی نتیجه‌ای نداشت
+            query_grams = trigrams(joined)
+            shared = Counter()
+            for gram in query_grams:
+                shared.update(self.grams.get(gram, ()))
+            for key_pos, count in shared.items():
+                similarity = count / (len(query_grams) + self.gram_counts[key_pos] - count)
+                if similarity >= 0.3:
+                    pos = self.key_coins[key_pos]
+                    scores[pos] = max(scores.get(pos, 0), similarity)
+        # رتبه بالاتر اول؛ در امتیاز برابر، ارز محبوب‌تر (جایگاه بالاتر در لیست)
+        ranked = sorted(scores, key=lambda pos: (-scores[pos], pos))
+        return [self.coins[pos] for pos in ranked[:limit]]
+
+# کلاس فهرست ارزها: ارزهای منتخب (CURRENCIES) اول و سپس فهرست کامل CoinGecko
+# فهرست مشترک در جدول coin_list دیتابیس است و فایل روی دیسک فقط کش محلی برای بارگذاری سریع هنگام شروع است
+# برای کم کردن مصرف حافظه در ده‌ها هزار ارز، داده‌ها در لیست‌های موازی نگه داشته می‌شوند
+class CoinUniverse:
+    def __init__(self, storage, path=COIN_LIST_PATH):
+        self.storage = storage
+        self.path = path
+        self.version = None  # updated_at فهرست دیتابیس که بارگذاری شده است
+        self.load([])
+
+    def load(self, coins):
+        self.apply(self.build(coins))
+
+    def apply(self, built):
+        self.ids, self.symbols, self.names, self.pos, self.by_symbol, self.search_index = built
+        self.total_pages = (len(self.ids) + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
+
+    # ساخت لیست‌ها و ایندکس جستجو بدون تغییر وضعیت فعلی تا بتواند بیرون از حلقه رویداد اجرا شود
+    @staticmethod
+    def build(coins):
+        ids, symbols, names = [], [], []
+        for coin_id in CURRENCIES:
+            ids.append(coin_id)
+            symbols.append(COIN_SYMBOLS.get(coin_id, ''))
+            names.append(None)
+        pos = {coin_id: i for i, coin_id in enumerate(ids)}
+        for coin in coins:
+            coin_id = coin.get('id')
+            if not coin_id:
+                continue
+            symbol = sys.intern((coin.get('symbol') or '').upper())
+            if coin_id in pos:
+                i = pos[coin_id]
+                symbols[i] = symbols[i] or symbol
+                names[i] = coin.get('name') or None
+            else:
+                pos[coin_id] = len(ids)
+                ids.append(sys.intern(coin_id))
+                symbols.append(symbol)
+                names.append(coin.get('name') or None)
+        by_symbol = {}  # نماد -> اولین (محبوب‌ترین) ارز با آن نماد
+        for i, symbol in enumerate(symbols):
+            if symbol:
+                by_symbol.setdefault(symbol, ids[i])
+        # نام فارسی بدون نماد داخل پرانتز هم یک نام کامل است (برای تطبیق کامل در resolve)
+        search_index = SearchIndex(
+            (coin_id, [names[i] or '', symbols[i], CURRENCIES.get(coin_id, ''), CURRENCIES.get(coin_id, '').split(' (')[0]])
+            for i, coin_id in enumerate(ids)
+        )
+        return ids, symbols, names, pos, by_symbol, search_index
+
+    def load_file(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self.load(json.load(f))
+            logger.info(f"فهرست {len(self.ids)} ارز از {self.path} بارگذاری شد")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"خطا در خواندن فهرست ارزها از {self.path}: {e}")
+
+    def save_file(self, text):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, self.path)
+
+    # ساخت فهرست جدید بیرون از حلقه رویداد (ده‌ها هزار ارز نزدیک یک ثانیه طول می‌کشد) و جایگزینی یک‌جای آن
+    async def replace(self, text, version):
+        self.apply(await asyncio.to_thread(lambda: self.build(json.loads(text))))
+        self.version = version
+        coin_menu.cache_clear()
+        coin_actions_menu.cache_clear()
+        logger.info(f"فهرست ارزها به‌روز شد: {len(self.ids)} ارز")
+        try:
+            await asyncio.to_thread(self.save_file, text)
+        except OSError as e:
+            logger.warning(f"خطا در ذخیره فهرست ارزها در {self.path}: {e}")
+
+    # رزرو کوتاه‌مدت دریافت فهرست کهنه تا فقط یک فرایند آن را از CoinGecko بگیرد (رزرو ناموفق خودش منقضی می‌شود)
+    @staticmethod
+    def claim_refresh(cur):
         cur.execute("""
-            INSERT INTO users (user_id, lang, daily_report, first_name, last_name)
-            VALUES (%s, %s, %s, %s, %s)
-            ON CONFLICT (user_id) DO UPDATE SET first_name = %s, last_name = %s
-        """, (user_id, 'en', False, first_name, last_name, first_name, last_name))
-        storage.save_data()
-    
-    storage.load_data()
-    lang = storage.users[user_id]['lang']
-    daily_status = LANGUAGES[lang]['daily_on'] if storage.users[user_id]['daily_report'] else LANGUAGES[lang]['daily_off']
-    
-    logger.info(f"داده‌های فعلی: {storage.users}")
-    logger.info(f"هشدارهای فعلی: {storage.alerts}")
-    
-    keyboard = [
+            UPDATE coin_list SET refresh_until = now() + interval '5 minutes'
+            WHERE id = 1 AND (updated_at IS NULL OR updated_at < now() - make_interval(hours => %s))
+                AND (refresh_until IS NULL OR refresh_until < now())
+            RETURNING id
+        """, (COIN_LIST_REFRESH_HOURS,))
+        return cur.fetchone() is not None
+
+    async def refresh(self):
+        coins = await coingecko.get_json('/coins/list')
+        coins = [{'id': c['id'], 'symbol': c.get('symbol', ''), 'name': c.get('name', '')} for c in coins if c.get('id')]
+        text = json.dumps(coins, ensure_ascii=False, separators=(',', ':'))
+        row = await self.storage.fetchone(
+            "UPDATE coin_list SET coins = %s, updated_at = now(), refresh_until = NULL WHERE id = 1 RETURNING updated_at",
+            (text,)
+        )
+        await self.replace(text, row['updated_at'])
+
+    # همگام‌سازی دوره‌ای در همه فرایندها: فهرست کهنه را فرایندی که رزروش کرده از CoinGecko می‌گیرد
+    # و بقیه نسخه تازه دیتابیس را بارگذاری می‌کنند
+    async def sync(self):
+        if await self.storage.run(self.claim_refresh):
+            try:
+                await self.refresh()
+                return
+            except Exception as e:
+                logger.error(f"خطا در دریافت فهرست ارزها از CoinGecko: {e}")
+        row = await self.storage.fetchone("SELECT updated_at FROM coin_list WHERE id = 1")
+        if row is None or row['updated_at'] is None or row['updated_at'] == self.version:
+            return
+        row = await self.storage.fetchone("SELECT coins, updated_at FROM coin_list WHERE id = 1")
+        await self.replace(row['coins'], row['updated_at'])
+
+    def __contains__(self, coin):
+        return coin in self.pos
+
+    # نام نمایشی ارز: نام فارسی فقط برای ارزهای منتخب وجود دارد و بقیه از نام انگلیسی استفاده می‌کنند
+    def name(self, coin, lang='en'):
+        if lang == 'fa' and coin in CURRENCIES:
+            return CURRENCIES[coin]
+        i = self.pos.get(coin)
+        if i is not None and self.names[i]:
+            return self.names[i]
+        return coin.capitalize()
+
+    def symbol(self, coin):
+        i = self.pos.get(coin)
+        return self.symbols[i] if i is not None else ''
+
+    # شناسه ارز از متن کاربر: شناسه، نماد یا نام فارسی دقیق، وگرنه ارزی که نام کاملش با کل متن یکی است؛
+    # تطبیق پیشوندی و تقریبی پذیرفته نمی‌شود تا مثلاً «bitcoin cash» به bitcoin نرسد
+    def resolve(self, text):
+        text = text.strip()
+        if text.lower() in self.pos:
+            return text.lower()
+        coin = self.by_symbol.get(text.upper())
+        if coin is not None:
+            return coin
+        for coin, name in CURRENCIES.items():
+            if name == text:
+                return coin
+        return self.search_index.exact(text)
+
+    def page(self, page):
+        return self.ids[page * ITEMS_PER_PAGE:(page + 1) * ITEMS_PER_PAGE]
+
+    def search(self, query, limit=5):
+        return self.search_index.search(query, limit)
+
+coin_universe = CoinUniverse(storage)
+
+# منوها فقط به (زبان، وضعیت، صفحه) وابسته‌اند، پس یک بار ساخته و از کش استفاده می‌شوند
+@lru_cache(maxsize=None)
+def back_menu(lang):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
+    ])
+
+@lru_cache(maxsize=None)
+def main_menu(lang, daily):
+    daily_status = LANGUAGES[lang]['daily_on'] if daily else LANGUAGES[lang]['daily_off']
+    return InlineKeyboardMarkup([
         [InlineKeyboardButton(LANGUAGES[lang]['price'], callback_data='price_0'),
          InlineKeyboardButton(LANGUAGES[lang]['set_alert'], callback_data='alert_0')],
         [InlineKeyboardButton(LANGUAGES[lang]['alerts_list'], callback_data='alerts_list'),
@@ -437,27 +2670,161 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton(LANGUAGES[lang]['my_data'], callback_data='my_data'),
          InlineKeyboardButton(LANGUAGES[lang]['language'], callback_data='language')],
         [InlineKeyboardButton(LANGUAGES[lang]['developer'], callback_data='developer')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    ])
+
+@lru_cache(maxsize=None)
+def alerts_menu(lang):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(LANGUAGES[lang]['delete_alert'], callback_data='delete_menu'),
+         InlineKeyboardButton(LANGUAGES[lang]['delete_all'], callback_data='delete_all')],
+        [InlineKeyboardButton(LANGUAGES[lang]['bulk_alerts'], callback_data='bulk_alerts')],
+        [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
+    ])
+
+@lru_cache(maxsize=None)
+def empty_alerts_menu(lang):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(LANGUAGES[lang]['bulk_alerts'], callback_data='bulk_alerts')],
+        [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
+    ])
+
+@lru_cache(maxsize=None)
+def language_menu(lang):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("English", callback_data='lang_en'),
+         InlineKeyboardButton("فارسی", callback_data='lang_fa')],
+        [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
+    ])
+
+@lru_cache(maxsize=1024)
+def coin_actions_menu(coin, lang):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(LANGUAGES[lang]['price'], callback_data=f"price_{coin}"),
+         InlineKeyboardButton(LANGUAGES[lang]['set_alert'], callback_data=f"alert_{coin}")],
+        [InlineKeyboardButton(LANGUAGES[lang]['chart'], callback_data=f"chart_{coin}")],
+        [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
+    ])
+
+# منوی صفحه‌بندی ارزها برای اکشن‌های price / alert / chart
+@lru_cache(maxsize=1024)
+def coin_menu(action, page, lang):
+    coins = coin_universe.page(page)
+    keyboard = []
+    for i in range(0, len(coins), 2):
+        keyboard.append([
+            InlineKeyboardButton(coin_universe.name(coin, lang), callback_data=f"{action}_{coin}")
+            for coin in coins[i:i + 2]
+        ])
+    nav_row = []
+    if page > 0:
+        nav_row.append(InlineKeyboardButton(LANGUAGES[lang]['prev_page'], callback_data=f"{action}_{page-1}"))
+    if page < coin_universe.total_pages - 1:
+        nav_row.append(InlineKeyboardButton(LANGUAGES[lang]['next_page'], callback_data=f"{action}_{page+1}"))
+    if nav_row:
+        keyboard.append(nav_row)
+    keyboard.append([InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')])
+    text = LANGUAGES[lang]['select_coin'].format(page=page+1, total_pages=coin_universe.total_pages)
+    return text, InlineKeyboardMarkup(keyboard)
+
+# تابع شروع ربات
+# نام متریک هر دکمه: پیشوند دکمه‌های دارای پارامتر یا نام دکمه‌های ثابت (بقیه other تا تعداد برچسب‌ها محدود بماند)
+CALLBACK_ACTIONS = {
+    'alerts_list', 'delete_menu', 'delete_all', 'bulk_alerts', 'language', 'toggle_daily', 'developer', 'search',
+    'my_data', 'back_to_menu'
+}
+
+def callback_action(data):
+    if data in CALLBACK_ACTIONS:
+        return data
+    if data.startswith('delete_alert_'):
+        return 'delete_alert'
+    prefix = data.split('_')[0]
+    return prefix if prefix in ('price', 'alert', 'chart', 'search', 'lang') else 'other'
+
+# ثبت زمان اجرا و خطاهای هر پاسخ‌دهنده تلگرام
+def instrumented(handler):
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        name = handler.__name__
+        if update.callback_query is not None and update.callback_query.data:
+            name = f"{name}:{callback_action(update.callback_query.data)}"
+        start = time.perf_counter()
+        try:
+            return await handler(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, handler=name)
+    return wrapper
+
+# وضعیت گفتگو (ارز در انتظار قیمت، جستجو، هشدار گروهی) در حالت چندفرایندی از ستون users.state خوانده و در صورت تغییر
+# ذخیره می‌شود تا پیام بعدی کاربر به هر نسخه‌ای از ربات برسد همان وضعیت را ببیند
+def with_state(handler):
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not storage.shared:
+            return await handler(update, context)
+        user_id = str(update.effective_user.id)
+        state = await storage.user_state(user_id)
+        context.user_data.clear()
+        context.user_data.update(state)
+        try:
+            return await handler(update, context)
+        finally:
+            if context.user_data != state:
+                await storage.set_user_state(user_id, dict(context.user_data))
+    return wrapper
+
+# کاربر صاحب به‌روزرسانی؛ کاربری که ثبت نشده (مثلاً دکمه پیام قدیمی را پس از پاک شدن دیتابیس زده) ثبت می‌شود
+async def current_user(update: Update):
+    user_id = str(update.effective_user.id)
+    user = await storage.get_user(user_id)
+    if user is None:
+        user = await storage.upsert_user(
+            user_id, update.effective_user.first_name or "Unknown", update.effective_user.last_name or "Unknown"
+        )
+    return user_id, user
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    first_name = update.effective_user.first_name or "Unknown"
+    last_name = update.effective_user.last_name or "Unknown"
+    
+    user = await storage.upsert_user(user_id, first_name, last_name)
+    lang = user.lang
+    
+    reply_markup = main_menu(lang, user.daily_report)
     if update.message:
         await update.message.reply_text(LANGUAGES[lang]['welcome'], reply_markup=reply_markup)
     elif update.callback_query:
         await update.callback_query.edit_message_text(LANGUAGES[lang]['welcome'], reply_markup=reply_markup)
 # تابع راهنما
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    lang = storage.users.get(user_id, {}).get('lang', 'en')
+    user = await storage.get_user(str(update.effective_user.id))
+    lang = user.lang if user is not None else 'en'
     await update.message.reply_text(LANGUAGES[lang]['help'])
 
+# تابع نمایش لیست هشدارهای کاربر
+async def show_alerts(query, user_id, lang):
+    alerts = await storage.user_alerts(user_id)
+    if not alerts:
+        await query.edit_message_text(
+            LANGUAGES[lang]['alerts_empty'],
+            reply_markup=empty_alerts_menu(lang)
+        )
+    else:
+        alert_list = [LANGUAGES[lang]['alerts_title']]
+        for alert in alerts:
+            coin_name = coin_universe.name(alert.coin, lang)
+            alert_list.append(f"{coin_name}: ${alert.price}")
+        alert_list.append("")  # خط خالی قبل از دکمه
+        await query.edit_message_text("\n".join(alert_list), reply_markup=alerts_menu(lang))
+
 # تابع مدیریت دکمه‌ها
 async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    user_id = str(query.from_user.id)
-    lang = storage.users[user_id]['lang']
-    coins = list(CURRENCIES.keys())
-    items_per_page = 10
-    total_pages = (len(coins) + items_per_page - 1) // items_per_page
+    user_id, user = await current_user(update)
+    lang = user.lang
 
     data_parts = query.data.split('_')
     action = data_parts[0]
@@ -465,118 +2832,68 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if action in ('price', 'alert', 'chart'):
         try:
             page = int(data_parts[1])  # حالت صفحه‌بندی
-            start_idx = page * items_per_page
-            end_idx = min(start_idx + items_per_page, len(coins))
-            keyboard = []
-            for i in range(start_idx, end_idx, 2):
-                row = []
-                row.append(InlineKeyboardButton(
-                    CURRENCIES[coins[i]] if lang == 'fa' else coins[i].capitalize(),
-                    callback_data=f"{action}_{coins[i]}"
-                ))
-                if i + 1 < end_idx:
-                    row.append(InlineKeyboardButton(
-                        CURRENCIES[coins[i+1]] if lang == 'fa' else coins[i+1].capitalize(),
-                        callback_data=f"{action}_{coins[i+1]}"
-                    ))
-                keyboard.append(row)
-            nav_row = []
-            if page > 0:
-                nav_row.append(InlineKeyboardButton(LANGUAGES[lang]['prev_page'], callback_data=f"{action}_{page-1}"))
-            if page < total_pages - 1:
-                nav_row.append(InlineKeyboardButton(LANGUAGES[lang]['next_page'], callback_data=f"{action}_{page+1}"))
-            if nav_row:
-                keyboard.append(nav_row)
-            keyboard.append([InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')])
-            await query.edit_message_text(
-                LANGUAGES[lang]['select_coin'].format(page=page+1, total_pages=total_pages),
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
+            text, reply_markup = coin_menu(action, page, lang)
+            await query.edit_message_text(text, reply_markup=reply_markup)
         except ValueError:  # حالت انتخاب ارز
             coin = data_parts[1]
             if action == 'price':
-                price, change = get_crypto_price(coin)
+                price, change, stale = await get_crypto_price(coin)
                 if price is not None:
-                    coin_name = CURRENCIES[coin] if lang == 'fa' else coin.capitalize()
+                    coin_name = coin_universe.name(coin, lang)
                     change_str = f"{change:+.2f}"
-                    await query.edit_message_text(
+                    text = (
                         f"{LANGUAGES[lang]['current_price'].format(coin=coin_name, price=price)}\n"
-                        f"{LANGUAGES[lang]['change_24h'].format(change=change_str)}",
-                        reply_markup=InlineKeyboardMarkup([
-                            [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
-                        ])
+                        f"{LANGUAGES[lang]['change_24h'].format(change=change_str)}"
                     )
+                    if stale is not None:
+                        text += f"\n{stale_notice(stale, lang)}"
+                    await query.edit_message_text(text, reply_markup=back_menu(lang))
                 else:
                     await query.edit_message_text("Could not fetch price." if lang == 'en' else "نمی‌توان قیمت را دریافت کرد.")
             elif action == 'alert':
                 context.user_data['alert_coin'] = coin
-                coin_name = CURRENCIES[coin] if lang == 'fa' else coin.capitalize()
+                coin_name = coin_universe.name(coin, lang)
                 await query.edit_message_text(
                     LANGUAGES[lang]['enter_price'].format(coin=coin_name),
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
-                    ])
+                    reply_markup=back_menu(lang)
                 )
             elif action == 'chart':         
-                coin_name = CURRENCIES[coin] if lang == 'fa' else coin.capitalize()
-                if coin in COIN_SYMBOLS:
+                coin_name = coin_universe.name(coin, lang)
+                coin_symbol = coin_universe.symbol(coin)
+                if coin_symbol:
                     if coin == 'bitcoin':
-                        symbol = COIN_SYMBOLS[coin]  # فقط BTC
+                        symbol = coin_symbol  # فقط BTC
                     elif coin == 'tether':
-                        symbol = COIN_SYMBOLS[coin]  # فقط USDT
+                        symbol = coin_symbol  # فقط USDT
                     else:
-                        symbol = f"BINANCE:{COIN_SYMBOLS[coin]}USDT"  # جفت‌ارز بایننس
+                        symbol = f"BINANCE:{coin_symbol}USDT"  # جفت‌ارز بایننس
                     chart_url = f"https://www.tradingview.com/chart/?symbol={symbol}"
                     await query.edit_message_text(
                         LANGUAGES[lang]['chart_link'].format(coin=coin_name, url=chart_url),
-                        reply_markup=InlineKeyboardMarkup([
-                            [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
-                        ])
+                        reply_markup=back_menu(lang)
                     )
                 else:
                     await query.edit_message_text(
                         "نمودار برای این ارز در دسترس نیست" if lang == 'fa' else "Chart not available for this coin",
-                        reply_markup=InlineKeyboardMarkup([
-                            [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
-                        ])
+                        reply_markup=back_menu(lang)
                     )
 
     elif query.data == 'alerts_list':
-        alerts = storage.alerts.get(user_id, [])
-        if not alerts:
-            await query.edit_message_text(
-                LANGUAGES[lang]['alerts_empty'],
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
-                ])
-            )
-        else:
-            alert_list = [LANGUAGES[lang]['alerts_title']]
-            for alert in alerts:
-                coin_name = CURRENCIES[alert['coin']] if lang == 'fa' else alert['coin'].capitalize()
-                alert_list.append(f"{coin_name}: ${alert['price']}")
-            alert_list.append("")  # خط خالی قبل از دکمه
-            keyboard = [
-                [InlineKeyboardButton(LANGUAGES[lang]['delete_alert'], callback_data='delete_menu')],
-                [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
-            ]
-            await query.edit_message_text("\n".join(alert_list), reply_markup=InlineKeyboardMarkup(keyboard))
+        await show_alerts(query, user_id, lang)
 
     elif query.data == 'delete_menu':
-        alerts = storage.alerts.get(user_id, [])
+        alerts = await storage.user_alerts(user_id)
         if not alerts:
             await query.edit_message_text(
                 LANGUAGES[lang]['alerts_empty'],
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
-                ])
+                reply_markup=back_menu(lang)
             )
         else:
             keyboard = []
             for i, alert in enumerate(alerts):
-                coin_name = CURRENCIES[alert['coin']] if lang == 'fa' else alert['coin'].capitalize()
+                coin_name = coin_universe.name(alert.coin, lang)
                 keyboard.append([InlineKeyboardButton(
-                    f"{coin_name}: ${alert['price']}",
+                    f"{coin_name}: ${alert.price}",
                     callback_data=f"delete_alert_{i}"
                 )])
             keyboard.append([InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')])
@@ -587,72 +2904,72 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     elif query.data.startswith('delete_alert_'):
         alert_index = int(query.data.split('_')[2])
-        alerts = storage.alerts.get(user_id, [])
+        alerts = await storage.user_alerts(user_id)
         if 0 <= alert_index < len(alerts):
-            with storage.conn.cursor() as cur:
-                cur.execute("SELECT id FROM alerts WHERE user_id = %s ORDER BY id", (user_id,))
-                alert_ids = [row['id'] for row in cur.fetchall()]
-                if alert_index < len(alert_ids):
-                    cur.execute("DELETE FROM alerts WHERE id = %s", (alert_ids[alert_index],))
-                    storage.save_data()
-                    storage.load_data()
+            await storage.delete_alert(user_id, alerts[alert_index].id)
             await query.edit_message_text(
                 LANGUAGES[lang]['alert_deleted'],
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
-                ])
+                reply_markup=back_menu(lang)
             )
         else:
-            await button(update, context)  # برگشت به لیست هشدارها
+            await show_alerts(query, user_id, lang)  # برگشت به لیست هشدارها
+
+    elif query.data == 'delete_all':
+        deleted = await storage.delete_alerts(user_id)
+        await query.edit_message_text(
+            LANGUAGES[lang]['alerts_deleted'].format(count=len(deleted)),
+            reply_markup=back_menu(lang)
+        )
+
+    elif query.data == 'bulk_alerts':
+        context.user_data.pop('alert_coin', None)
+        context.user_data['bulk_alerts'] = True
+        await query.edit_message_text(
+            LANGUAGES[lang]['bulk_prompt'],
+            reply_markup=back_menu(lang)
+        )
 
     elif query.data == 'language':
-        keyboard = [
-            [InlineKeyboardButton("English", callback_data='lang_en'),
-             InlineKeyboardButton("فارسی", callback_data='lang_fa')],
-            [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
-        ]
         await query.edit_message_text(
             "Select language / زبان را انتخاب کنید:",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=language_menu(lang)
         )
 
     elif query.data == 'toggle_daily':
-        with storage.conn.cursor() as cur:
-            cur.execute("UPDATE users SET daily_report = NOT daily_report WHERE user_id = %s RETURNING daily_report", (user_id,))
-            new_status = cur.fetchone()['daily_report']
-            storage.save_data()
-        storage.load_data()
+        new_status = await storage.toggle_daily(user_id)
         message = LANGUAGES[lang]['daily_report_enabled'] if new_status else LANGUAGES[lang]['daily_report_disabled']
         await query.edit_message_text(
             message,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
-            ])
+            reply_markup=back_menu(lang)
         )
 
     elif query.data == 'developer':
         await query.edit_message_text(
             LANGUAGES[lang]['developer_info'],
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
-            ])
+            reply_markup=back_menu(lang)
         )
 
     elif query.data == 'search':
         await query.edit_message_text(
             LANGUAGES[lang]['search_prompt'],
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
-            ])
+            reply_markup=back_menu(lang)
         )
         context.user_data['search_mode'] = True
 
+    elif query.data.startswith('search_'):
+        coin = query.data.split('_', 1)[1]
+        coin_name = coin_universe.name(coin, lang)
+        await query.edit_message_text(
+            LANGUAGES[lang]['search_result'].format(coin=coin_name),
+            reply_markup=coin_actions_menu(coin, lang)
+        )
+
     elif query.data == 'my_data':
-        first_name = storage.users[user_id]['first_name']
-        last_name = storage.users[user_id]['last_name']
-        daily_status = LANGUAGES[lang]['daily_on'] if storage.users[user_id]['daily_report'] else LANGUAGES[lang]['daily_off']
-        alerts = storage.alerts.get(user_id, [])
-        alerts_text = "\n".join([f"{CURRENCIES[a['coin']] if lang == 'fa' else a['coin'].capitalize()}: ${a['price']}" for a in alerts]) if alerts else LANGUAGES[lang]['alerts_empty']
+        first_name = user.first_name
+        last_name = user.last_name
+        daily_status = LANGUAGES[lang]['daily_on'] if user.daily_report else LANGUAGES[lang]['daily_off']
+        alerts = await storage.user_alerts(user_id)
+        alerts_text = "\n".join([f"{coin_universe.name(a.coin, lang)}: ${a.price}" for a in alerts]) if alerts else LANGUAGES[lang]['alerts_empty']
         data_text = (
             f"{LANGUAGES[lang]['my_data_title'].format(last_name=f'{first_name} {last_name}')}\n"
             f"{LANGUAGES[lang]['my_data_lang'].format(lang='English' if lang == 'en' else 'فارسی')}\n"
@@ -661,102 +2978,425 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         await query.edit_message_text(
             data_text,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
-            ])
+            reply_markup=back_menu(lang)
         )
 
     elif query.data.startswith('lang_'):
         new_lang = query.data.split('_')[1]
-        with storage.conn.cursor() as cur:
-            cur.execute("UPDATE users SET lang = %s WHERE user_id = %s", (new_lang, user_id))
-            storage.save_data()
-        storage.load_data()
+        await storage.set_lang(user_id, new_lang)
         await start(update, context)  # نمایش منو با زبان جدید
 
     elif query.data == 'back_to_menu':
         await start(update, context)
 
+# ارقام و علامت‌های فارسی و عربی به معادل لاتین (ممیز، جداکننده هزارگان و درصد)
+DIGITS = str.maketrans('۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩٫٬٪', '01234567890123456789.,%')
+ALERT_TARGET = re.compile(r'^([+-]?)\$?(\d+\.?\d*|\.\d+)(%?)$')
+
+# تابع تجزیه متن هشدارها: هر خط (یا بخش جداشده با ;) نام ارز و سپس یک یا چند هدف است و بدون نام، ارز coin استفاده می‌شود
+# هدف قیمت دلاری یا درصد تغییر نسبت به قیمت فعلی است (مثل -10%)؛ خروجی (coin, value, percent) و بخش‌های نامفهوم است
+def parse_alert_targets(text, coin=None):
+    targets, invalid = [], []
+    for entry in re.split(r'[\n;]+', text.translate(DIGITS)):
+        words = entry.replace(',', '').split()
+        if not words:
+            continue
+        parsed = []
+        while words and (match := ALERT_TARGET.match(words[-1])):
+            parsed.insert(0, match)
+            words.pop()
+        entry_coin = coin_universe.resolve(' '.join(words)) if words else coin
+        # قیمت منفی و هدف صفر پذیرفته نمی‌شود (+ در قیمت دلاری بی‌اثر است)
+        if not parsed or entry_coin is None or any(
+            (match.group(1) == '-' and not match.group(3)) or not float(match.group(2))
+            for match in parsed
+        ):
+            invalid.append(entry.strip())
+            continue
+        for match in parsed:
+            value = float(match.group(2))
+            percent = bool(match.group(3))
+            targets.append((entry_coin, -value if match.group(1) == '-' else value, percent))
+    return targets, invalid
+
+# تابع ثبت هشدارهای تجزیه‌شده: قیمت فعلی همه ارزها با یک درخواست گرفته و هشدارها با یک INSERT ثبت می‌شوند
+# قیمت اولیه جهت هشدار و پایه درصدهاست، پس قیمت قدیمی زمان قطعی پذیرفته نمی‌شود؛
+# ارزهایی که قیمت تازه‌شان در دسترس نیست (یا درصدشان هدف نامعتبر می‌سازد) جداگانه برگردانده می‌شوند
+async def add_parsed_alerts(user_id, targets):
+    if not targets:
+        return [], []
+    try:
+        prices = await price_cache.get_many(list(dict.fromkeys(coin for coin, _, _ in targets)), stale=False)
+    except Exception as e:
+        logger.error(f"خطا در دریافت قیمت برای ثبت هشدارها: {e}")
+        prices = {}
+    rows, failed = [], []
+    for coin, value, percent in targets:
+        current = prices.get(coin, {}).get('usd')
+        price = float(f"{current * (1 + value / 100):.8g}") if current and percent else value
+        if not current or price <= 0:
+            failed.append(coin)
+        else:
+            rows.append((coin, price, current))
+    return await storage.add_alerts(user_id, rows), list(dict.fromkeys(failed))
+
 # تابع مدیریت پیام‌های ورودی
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    lang = storage.users[user_id]['lang']
+    user_id, user = await current_user(update)
+    lang = user.lang
 
-    if 'alert_coin' in context.user_data:
-        coin = context.user_data['alert_coin']
-        try:
-            target_price = float(update.message.text)
-            current_price, _ = get_crypto_price(coin)
-            if current_price is None:
-                raise ValueError("Could not fetch current price")
-            
-            with storage.conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO alerts (user_id, coin, price, original_price)
-                    VALUES (%s, %s, %s, %s)
-                """, (user_id, coin, target_price, current_price))
-                storage.save_data()
-            
-            coin_name = CURRENCIES[coin] if lang == 'fa' else coin.capitalize()
+    if 'alert_coin' in context.user_data or context.user_data.get('bulk_alerts', False):
+        coin = context.user_data.get('alert_coin')
+        targets, invalid = parse_alert_targets(update.message.text, coin)
+        if len(targets) > BULK_ALERTS_MAX:
             await update.message.reply_text(
-                LANGUAGES[lang]['alert_set'].format(coin=coin_name, price=target_price),
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
-                ])
+                LANGUAGES[lang]['bulk_limit'].format(limit=BULK_ALERTS_MAX),
+                reply_markup=back_menu(lang)
             )
-            del context.user_data['alert_coin']
-            storage.load_data()
-        except ValueError:
+            return
+        alerts, failed = await add_parsed_alerts(user_id, targets)
+        invalid += [coin_universe.name(failed_coin, lang) for failed_coin in failed]
+        if not alerts:
             await update.message.reply_text(
-                "Please enter a valid number" if lang == 'en' else "لطفاً یک عدد معتبر وارد کنید",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
-                ])
+                ("Please enter a valid number" if lang == 'en' else "لطفاً یک عدد معتبر وارد کنید")
+                if coin is not None else LANGUAGES[lang]['bulk_prompt'],
+                reply_markup=back_menu(lang)
             )
+            return
+        if len(alerts) == 1 and not invalid:
+            text = LANGUAGES[lang]['alert_set'].format(coin=coin_universe.name(alerts[0].coin, lang), price=alerts[0].price)
+        else:
+            text = LANGUAGES[lang]['alerts_added'].format(
+                count=len(alerts),
+                alerts="\n".join(f"{coin_universe.name(alert.coin, lang)}: ${alert.price}" for alert in alerts)
+            )
+            if invalid:
+                text += "\n\n" + LANGUAGES[lang]['alerts_invalid'].format(entries="\n".join(invalid[:10]))
+        await update.message.reply_text(text, reply_markup=back_menu(lang))
+        context.user_data.pop('alert_coin', None)
+        context.user_data.pop('bulk_alerts', None)
 
     elif context.user_data.get('search_mode', False):
-        search_term = update.message.text.lower()
-        found = None
-        for coin_id, coin_name in CURRENCIES.items():
-            if search_term in coin_id.lower() or search_term in coin_name.lower():
-                found = coin_id
-                break
-        if found:
-            coin_name = CURRENCIES[found] if lang == 'fa' else found.capitalize()
+        results = coin_universe.search(update.message.text, limit=SEARCH_RESULTS)
+        if len(results) == 1:
+            coin_name = coin_universe.name(results[0], lang)
             await update.message.reply_text(
                 LANGUAGES[lang]['search_result'].format(coin=coin_name),
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton(LANGUAGES[lang]['price'], callback_data=f"price_{found}"),
-                     InlineKeyboardButton(LANGUAGES[lang]['set_alert'], callback_data=f"alert_{found}")],
-                    [InlineKeyboardButton(LANGUAGES[lang]['chart'], callback_data=f"chart_{found}")],
-                    [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
-                ])
+                reply_markup=coin_actions_menu(results[0], lang)
+            )
+        elif results:
+            keyboard = [
+                [InlineKeyboardButton(coin_universe.name(coin, lang), callback_data=f"search_{coin}")]
+                for coin in results
+            ]
+            keyboard.append([InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')])
+            await update.message.reply_text(
+                LANGUAGES[lang]['search_results'].format(count=len(results)),
+                reply_markup=InlineKeyboardMarkup(keyboard)
             )
         else:
             await update.message.reply_text(
                 LANGUAGES[lang]['search_no_result'],
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton(LANGUAGES[lang]['back_to_menu'], callback_data='back_to_menu')]
-                ])
+                reply_markup=back_menu(lang)
             )
         del context.user_data['search_mode']
 
+# تابع خلاصه‌سازی دوره‌ای تاریخچه قیمت
+async def downsample_history(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await price_history.downsample()
+    except Exception as e:
+        logger.error(f"خطا در خلاصه‌سازی تاریخچه قیمت: {e}")
+
+# تابع همگام‌سازی دوره‌ای فهرست ارزها با دیتابیس (در همه فرایندها، از جمله کارگرهای هشدار)
+async def refresh_coin_list():
+    try:
+        await coin_universe.sync()
+    except Exception as e:
+        logger.error(f"خطا در به‌روزرسانی فهرست ارزها: {e}")
+
+# زمان‌بند کارهای دوره‌ای؛ کارها در main اضافه و زمان‌بند در on_startup (یا run_alert_worker) روی حلقه رویداد شروع می‌شود
+scheduler = AsyncIOScheduler()
+
+# کار زمان‌بندی‌شده‌ای که باید در کل سامانه یک بار اجرا شود (نه یک بار در هر نسخه)
+def leader_only(job):
+    @wraps(job)
+    async def wrapper(*args):
+        try:
+            if not await storage.is_leader():
+                return
+        except Exception as e:
+            logger.error(f"خطا در بررسی رهبری کارهای زمان‌بندی‌شده: {e}")
+            return
+        await job(*args)
+    return wrapper
+
+HttpRequest = namedtuple('HttpRequest', 'method path query headers body')
+
+# کلاس سرور HTTP کوچک روی asyncio برای وب‌هوک، بررسی سلامت و متریک‌ها
+# هر درخواست یک اتصال است (Connection: close) و پاسخ‌دهنده‌ها (status, body[, content_type]) برمی‌گردانند
+class HttpServer:
+    MAX_BODY = 1024 * 1024
+    REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+    def __init__(self, host=HTTP_HOST, port=PORT):
+        self.host = host
+        self.port = port
+        self.routes = {}  # path -> {method: handler}
+        self.server = None
+
+    def route(self, method, path, handler):
+        self.routes.setdefault(path, {})[method] = handler
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"سرور HTTP روی {self.host}:{self.port} شروع شد")
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def read_request(self, reader):
+        request_line = (await reader.readline()).decode('latin-1').split()
+        if len(request_line) != 3:
+            return None
+        method, target, _ = request_line
+        path, _, query = target.partition('?')
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length') or 0)
+        body = await reader.readexactly(length) if 0 < length <= self.MAX_BODY else b''
+        return HttpRequest(method, path, dict(parse_qsl(query)), headers, body if length <= self.MAX_BODY else None)
+
+    async def dispatch(self, request):
+        if request.body is None:
+            return 413, 'too large'
+        handlers = self.routes.get(request.path)
+        if handlers is None:
+            return 404, 'not found'
+        handler = handlers.get(request.method)
+        if handler is None:
+            return 405, 'method not allowed'
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"خطا در پاسخ به {request.method} {request.path}: {e}")
+            return 500, 'error'
+
+    async def handle(self, reader, writer):
+        try:
+            request = await self.read_request(reader)
+            if request is None:
+                return
+            status, body, *content_type = await self.dispatch(request)
+            body = body.encode() if isinstance(body, str) else body
+            writer.write(
+                f"HTTP/1.1 {status} {self.REASONS.get(status, '')}\r\n"
+                f"Content-Type: {content_type[0] if content_type else 'text/plain; charset=utf-8'}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+# مسیرهای /metrics (قالب Prometheus) و /debug/profile?seconds=N (نمونه‌برداری پشته‌ها در قالب collapsed)
+def add_metrics_routes(server):
+    async def metrics_page(request):
+        return 200, metrics.render(), 'text/plain; version=0.0.4; charset=utf-8'
+
+    async def profile(request):
+        try:
+            seconds = min(float(request.query.get('seconds', 10)), PROFILE_MAX_SECONDS)
+        except ValueError:
+            return 400, 'bad seconds'
+        return 200, await asyncio.to_thread(sample_stacks, seconds)
+
+    server.route('GET', '/metrics', metrics_page)
+    server.route('GET', '/debug/profile', profile)
+
+# سرور جداگانه متریک‌ها؛ این مسیرها احراز هویت ندارند و روی پورت عمومی وب‌هوک سوار نمی‌شوند
+async def start_metrics_server():
+    if METRICS_PORT:
+        server = HttpServer(HTTP_HOST, METRICS_PORT)
+        add_metrics_routes(server)
+        await server.start()
+
+# تابع شروع جریان قیمت و کارهای زمان‌بندی‌شده پس از آماده شدن ربات
+async def on_startup(application: Application):
+    scheduler.start()
+    await start_metrics_server()
+    if not storage.shared:
+        alert_outbox.start(application.bot)
+        for source in make_price_sources():
+            spawn(run_price_feed(application.bot, source))
+
+# تابع آزادسازی منابع هنگام خاموش شدن ربات
+async def on_shutdown(application: Application):
+    await close_services()
+
+async def close_services():
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await send_queue.close()
+    await coingecko.close()
+
+# تابع اجرای فرایند کارگر هشدار (نقش alerts): بدون دریافت پیام‌های تلگرام،
+# فقط قیمت ارزهای بخش‌های رزروشده بررسی و صف خروجی هشدارها ارسال می‌شود
+async def run_alert_worker():
+    leases = PartitionLeases(storage)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await start_metrics_server()
+    scheduler.start()
+    async with Bot(TELEGRAM_TOKEN, base_url=TELEGRAM_BASE_URL) as bot:
+        await leases.sync()
+        await storage.resync()
+        alert_outbox.start(bot)
+        spawn(leases.run())
+        for source in make_price_sources():
+            spawn(run_price_feed(bot, source))
+        await stop.wait()
+        await close_services()
+    try:
+        await storage.run(leases.release)
+    except Exception as e:
+        logger.error(f"خطا در آزادسازی بخش‌های هشدار: {e}")
+
+# تابع اجرای ربات با وب‌هوک به‌جای long polling
+# پیام‌های تلگرام در WEBHOOK_PATH به صف به‌روزرسانی‌های برنامه اضافه و هم‌زمان پردازش می‌شوند؛
+# /healthz زنده بودن فرایند و /readyz آماده بودن برای دریافت پیام را نشان می‌دهد
+async def run_webhook(application):
+    server = HttpServer()
+    ready = asyncio.Event()
+
+    async def receive(request):
+        if WEBHOOK_SECRET and request.headers.get('x-telegram-bot-api-secret-token') != WEBHOOK_SECRET:
+            return 403, 'forbidden'
+        try:
+            update = Update.de_json(json.loads(request.body), application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"پیام نامعتبر در وب‌هوک: {e}")
+            return 400, 'bad update'
+        await application.update_queue.put(update)
+        return 200, 'ok'
+
+    async def healthz(request):
+        return 200, 'ok'
+
+    async def readyz(request):
+        return (200, 'ready') if ready.is_set() and application.running else (503, 'not ready')
+
+    server.route('POST', WEBHOOK_PATH, receive)
+    server.route('GET', '/healthz', healthz)
+    server.route('GET', '/readyz', readyz)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await server.start()
+    async with application:
+        await on_startup(application)
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES
+        )
+        await application.start()
+        ready.set()
+        await stop.wait()
+        ready.clear()
+        await application.stop()
+        await on_shutdown(application)
+    await server.stop()
+
+# تابع ساخت برنامه تلگرام با پاسخ‌دهنده‌ها (بدون شروع دریافت پیام)
+def build_application():
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .base_url(TELEGRAM_BASE_URL)
+        .concurrent_updates(TELEGRAM_CONCURRENT_UPDATES)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+    application.add_handler(CommandHandler("start", instrumented(start)))
+    application.add_handler(CommandHandler("help", instrumented(help_command)))
+    application.add_handler(CallbackQueryHandler(instrumented(with_state(button))))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, instrumented(with_state(handle_message))))
+    return application
+
 # تابع اصلی برنامه
+# نقش‌ها: all (پیش‌فرض، همه کارها در یک فرایند)، bot (فقط تلگرام و کارهای زمان‌بندی‌شده)، alerts (کارگر هشدار)
+# و web (مانند bot ولی با وب‌هوک)؛ در نقش‌های all و bot هم اگر WEBHOOK_URL تنظیم شده باشد وب‌هوک استفاده می‌شود
+# نقش migrate فقط مهاجرت‌های دیتابیس را اجرا می‌کند (مرحله release در Heroku)
 def main():
-    application = Application.builder().token('8003905325:AAHsnqAtfDjSYFZdfPCfDVZ7LnEnEbRR9_g').build()
-    
-    scheduler = AsyncIOScheduler()
-    scheduler.add_job(check_alerts, 'interval', seconds=CHECK_INTERVAL, args=[application])
-    scheduler.add_job(daily_report, 'cron', hour=2, minute=30, args=[application])  # 6:00 AM Tehran = 2:30 AM UTC
-    scheduler.start()
+    role = sys.argv[1] if len(sys.argv) > 1 else 'all'
+    if role not in ('all', 'bot', 'alerts', 'web', 'migrate'):
+        sys.exit(f"usage: {sys.argv[0]} [all|bot|alerts|web|migrate]")
+    if role == 'migrate':
+        storage.open(load=False)
+        storage.close()
+        return
+    if not TELEGRAM_TOKEN:
+        sys.exit("TELEGRAM_TOKEN is required")
+    if role == 'web' and not WEBHOOK_URL:
+        sys.exit("WEBHOOK_URL is required for the web role")
+    storage.shared = role != 'all'
+    if role == 'alerts':
+        storage.partitions = set()
+        storage.load_users = False
+    elif role != 'all':
+        storage.load_users = False  # کاربران هر بار از دیتابیس خوانده می‌شوند (get_user)
+        storage.load_alerts = False
+    # all با هیچ نقش دیگری و دریافت getUpdates با poller دیگر یا وب‌هوک هم‌زمان اجرا نمی‌شود (خطای 409 تلگرام،
+    # از کار افتادن polling با set_webhook یا بررسی دوباره هشدارها)؛ چند نسخه web و alerts با هم مجازند
+    locks = [(TOPOLOGY_LOCK, role == 'all')]
+    if role != 'alerts':
+        locks.append((INGRESS_LOCK, not WEBHOOK_URL))
+    if not storage.hold_locks(locks, TOPOLOGY_WAIT):
+        sys.exit(f"role {role} conflicts with a running process; run either 'all' alone or the bot/web/alerts roles")
+    storage.open()
+    coin_universe.load_file()
+    scheduler.add_job(refresh_coin_list, 'interval', minutes=COIN_LIST_SYNC_MINUTES, next_run_time=datetime.now(),
+                      misfire_grace_time=None)
+    if role == 'alerts':
+        try:
+            asyncio.run(run_alert_worker())
+        finally:
+            storage.close()
+        return
 
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CallbackQueryHandler(button))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application = build_application()
+    # هر نسخه bot/web زمان‌بند خودش را دارد ولی این کارها فقط در فرایند رهبر اجرا می‌شوند
+    scheduler.add_job(leader_only(daily_report), 'cron', hour=2, minute=30, args=[application])  # 6:00 AM Tehran = 2:30 AM UTC
+    scheduler.add_job(leader_only(downsample_history), 'interval', minutes=5, args=[application])
 
     try:
-        application.run_polling()
+        if WEBHOOK_URL:
+            asyncio.run(run_webhook(application))
+        else:
+            application.run_polling()
     finally:
         storage.close()
 